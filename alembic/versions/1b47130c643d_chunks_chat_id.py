@@ -0,0 +1,97 @@
+"""chunks chat_id
+
+Revision ID: 1b47130c643d
+Revises: 8990ee055c49
+Create Date: 2026-10-17 10:03:27.540915
+
+Denormalizes documents.chat_id onto chunks and makes (chat_id, id) the
+primary key. With CHUNKS_HASH_PARTITIONS > 0 the table is also rebuilt as
+HASH (chat_id) partitioned, so per-chat searches and deletes touch one
+partition and its own ANN index.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b47130c643d'
+down_revision: Union[str, None] = '8990ee055c49'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_chunk_indexes() -> None:
+    op.create_index('idx_chunks_document_id', 'chunks', ['document_id'], unique=False)
+    if config.VECTOR_INDEX_TYPE == "ivfflat":
+        using = "ivfflat"
+        with_ = {"lists": config.IVFFLAT_LISTS}
+    else:
+        using = "hnsw"
+        with_ = {"m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+    op.create_index(
+        'idx_chunks_embedding_ann',
+        'chunks',
+        ['embedding'],
+        unique=False,
+        postgresql_using=using,
+        postgresql_with=with_,
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def _is_partitioned() -> bool:
+    bind = op.get_bind()
+    return bool(
+        bind.execute(
+            sa.text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'chunks'::regclass")
+        ).scalar()
+    )
+
+
+def upgrade() -> None:
+    op.add_column('chunks', sa.Column('chat_id', sa.UUID(), nullable=True))
+    op.execute(
+        "UPDATE chunks SET chat_id = documents.chat_id "
+        "FROM documents WHERE documents.id = chunks.document_id"
+    )
+    # Chunks whose document is gone were never reachable from a chat.
+    op.execute("DELETE FROM chunks WHERE chat_id IS NULL")
+    op.alter_column('chunks', 'chat_id', nullable=False)
+    op.drop_constraint('chunks_pkey', 'chunks', type_='primary')
+    op.create_primary_key('chunks_pkey', 'chunks', ['chat_id', 'id'])
+
+    partitions = config.CHUNKS_HASH_PARTITIONS
+    if partitions > 0:
+        op.rename_table('chunks', 'chunks_unpartitioned')
+        op.execute("ALTER TABLE chunks_unpartitioned RENAME CONSTRAINT chunks_pkey TO chunks_unpartitioned_pkey")
+        op.execute(
+            "CREATE TABLE chunks (LIKE chunks_unpartitioned INCLUDING DEFAULTS) PARTITION BY HASH (chat_id)"
+        )
+        for i in range(partitions):
+            op.execute(
+                f"CREATE TABLE chunks_p{i} PARTITION OF chunks "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+            )
+        op.create_primary_key('chunks_pkey', 'chunks', ['chat_id', 'id'])
+        op.execute("INSERT INTO chunks SELECT * FROM chunks_unpartitioned")
+        op.drop_table('chunks_unpartitioned')
+        _create_chunk_indexes()
+
+
+def downgrade() -> None:
+    if _is_partitioned():
+        op.rename_table('chunks', 'chunks_partitioned')
+        op.execute("ALTER TABLE chunks_partitioned RENAME CONSTRAINT chunks_pkey TO chunks_partitioned_pkey")
+        op.execute("CREATE TABLE chunks (LIKE chunks_partitioned INCLUDING DEFAULTS)")
+        op.execute("INSERT INTO chunks SELECT * FROM chunks_partitioned")
+        op.drop_table('chunks_partitioned')
+        _create_chunk_indexes()
+    else:
+        op.drop_constraint('chunks_pkey', 'chunks', type_='primary')
+    op.create_primary_key('chunks_pkey', 'chunks', ['id'])
+    op.drop_column('chunks', 'chat_id')
@@ -0,0 +1,29 @@
+"""documents truncated
+
+Revision ID: 5c2e9a7f31d4
+Revises: 1b47130c643d
+Create Date: 2026-10-17 11:20:05.614382
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e9a7f31d4'
+down_revision: Union[str, None] = '1b47130c643d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'documents',
+        sa.Column('truncated', sa.Boolean(), server_default=sa.false(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'truncated')
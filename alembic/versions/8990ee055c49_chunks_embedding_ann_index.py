@@ -0,0 +1,43 @@
+"""chunks embedding ann index
+
+Revision ID: 8990ee055c49
+Revises: d517de868983
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import config
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8990ee055c49'
+down_revision: Union[str, None] = 'd517de868983'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Index type comes from VECTOR_INDEX_TYPE at migration time (hnsw by default).
+    if config.VECTOR_INDEX_TYPE == "ivfflat":
+        using = "ivfflat"
+        with_ = {"lists": config.IVFFLAT_LISTS}
+    else:
+        using = "hnsw"
+        with_ = {"m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+    op.create_index(
+        'idx_chunks_embedding_ann',
+        'chunks',
+        ['embedding'],
+        unique=False,
+        postgresql_using=using,
+        postgresql_with=with_,
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_chunks_embedding_ann', table_name='chunks')
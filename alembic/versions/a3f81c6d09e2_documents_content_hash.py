@@ -0,0 +1,29 @@
+"""documents content hash
+
+Revision ID: a3f81c6d09e2
+Revises: 5c2e9a7f31d4
+Create Date: 2026-10-17 12:41:17.203985
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f81c6d09e2'
+down_revision: Union[str, None] = '5c2e9a7f31d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing documents keep a NULL hash and are never matched as duplicates.
+    op.add_column('documents', sa.Column('content_hash', sa.String(), nullable=True))
+    op.create_index('idx_documents_chat_content_hash', 'documents', ['chat_id', 'content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_documents_chat_content_hash', table_name='documents')
+    op.drop_column('documents', 'content_hash')
@@ -0,0 +1,30 @@
+"""documents ingest state
+
+Revision ID: e6b19d4a7c05
+Revises: a3f81c6d09e2
+Create Date: 2026-10-17 16:05:42.518307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b19d4a7c05'
+down_revision: Union[str, None] = 'a3f81c6d09e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Pending documents from before this revision have no owner and are
+    # failed at startup once they are older than the stale bound.
+    op.add_column('documents', sa.Column('ingest_owner', sa.String(), nullable=True))
+    op.add_column('documents', sa.Column('ingest_error', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('documents', 'ingest_error')
+    op.drop_column('documents', 'ingest_owner')
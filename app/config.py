@@ -17,7 +17,10 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # Files
 VEC_PATH: Final[Path] = DATA_DIR / "vec.json"
+VEC_DIR: Final[Path] = DATA_DIR / "vec"
 REGISTRY_PATH: Final[Path] = DATA_DIR / "registry.json"
+# Uploads are streamed here and removed once their ingestion job finishes
+SPOOL_DIR: Final[Path] = DATA_DIR / "spool"
 
 # Runtime configuration
 GOOGLE_API_KEY: Final[str | None] = os.getenv("GOOGLE_API_KEY")
@@ -36,6 +39,175 @@ EMBEDDING_MODEL: Final[str] = "models/text-embedding-004"
 # Use a stable alias by default; can be overridden via env
 GENERATION_MODEL: Final[str] = os.getenv("GENERATION_MODEL", "gemini-2.5-flash")
 
+# Embedding requests: texts per batch call and batches in flight at once (per process)
+try:
+    EMBED_BATCH_SIZE: Final[int] = max(1, int(os.getenv("EMBED_BATCH_SIZE", "100")))
+except ValueError:
+    EMBED_BATCH_SIZE = 100
+try:
+    EMBED_CONCURRENCY: Final[int] = max(1, int(os.getenv("EMBED_CONCURRENCY", "4")))
+except ValueError:
+    EMBED_CONCURRENCY = 4
+
+# Embedding/generation provider: "google" (Gemini) or "local" (deterministic, offline)
+PROVIDER: Final[str] = os.getenv("PROVIDER", "google").lower()
+try:
+    LOCAL_PROVIDER_LATENCY_MS: Final[float] = float(os.getenv("LOCAL_PROVIDER_LATENCY_MS", "0"))
+except ValueError:
+    LOCAL_PROVIDER_LATENCY_MS = 0.0
+
+# Blocking provider (embedding/generation) calls run in a bounded thread pool
+try:
+    PROVIDER_CONCURRENCY: Final[int] = max(1, int(os.getenv("PROVIDER_CONCURRENCY", "8")))
+except ValueError:
+    PROVIDER_CONCURRENCY = 8
+try:
+    PROVIDER_TIMEOUT_SECONDS: Final[float] = float(os.getenv("PROVIDER_TIMEOUT_SECONDS", "60"))
+except ValueError:
+    PROVIDER_TIMEOUT_SECONDS = 60.0
+
+# PDF text extraction: worker processes and pages per task (1 worker = in-thread)
+try:
+    PARSE_WORKERS: Final[int] = max(1, int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+except ValueError:
+    PARSE_WORKERS = min(4, os.cpu_count() or 1)
+try:
+    PARSE_PAGES_PER_TASK: Final[int] = max(1, int(os.getenv("PARSE_PAGES_PER_TASK", "16")))
+except ValueError:
+    PARSE_PAGES_PER_TASK = 16
+
+# Per-document parse budgets (0 disables each). On a hit, "truncate" indexes what was
+# extracted and marks the Document truncated; "fail" rejects the document.
+try:
+    PARSE_MAX_PAGES: Final[int] = max(0, int(os.getenv("PARSE_MAX_PAGES", "2000")))
+except ValueError:
+    PARSE_MAX_PAGES = 2000
+try:
+    PARSE_MAX_CHARS: Final[int] = max(0, int(os.getenv("PARSE_MAX_CHARS", "5000000")))
+except ValueError:
+    PARSE_MAX_CHARS = 5000000
+try:
+    PARSE_DEADLINE_SECONDS: Final[float] = max(0.0, float(os.getenv("PARSE_DEADLINE_SECONDS", "120")))
+except ValueError:
+    PARSE_DEADLINE_SECONDS = 120.0
+PARSE_BUDGET_MODE: Final[str] = os.getenv("PARSE_BUDGET_MODE", "truncate").lower()
+
+# Shared outbound HTTP client (URL ingestion)
+try:
+    HTTP_TIMEOUT_SECONDS: Final[float] = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+except ValueError:
+    HTTP_TIMEOUT_SECONDS = 30.0
+try:
+    HTTP_MAX_CONNECTIONS: Final[int] = max(1, int(os.getenv("HTTP_MAX_CONNECTIONS", "20")))
+except ValueError:
+    HTTP_MAX_CONNECTIONS = 20
+try:
+    HTTP_MAX_KEEPALIVE: Final[int] = max(0, int(os.getenv("HTTP_MAX_KEEPALIVE", "10")))
+except ValueError:
+    HTTP_MAX_KEEPALIVE = 10
+
+# Background ingestion: worker tasks, queued jobs before uploads get 503, and how long
+# finished job statuses stay pollable
+try:
+    INGEST_WORKERS: Final[int] = max(1, int(os.getenv("INGEST_WORKERS", "2")))
+except ValueError:
+    INGEST_WORKERS = 2
+try:
+    INGEST_QUEUE_SIZE: Final[int] = max(1, int(os.getenv("INGEST_QUEUE_SIZE", "100")))
+except ValueError:
+    INGEST_QUEUE_SIZE = 100
+try:
+    INGEST_JOB_TTL_SECONDS: Final[int] = int(os.getenv("INGEST_JOB_TTL_SECONDS", "3600"))
+except ValueError:
+    INGEST_JOB_TTL_SECONDS = 3600
+
+# Ingest pipeline: parsed chunk batches buffered between the parser and the embedder
+try:
+    INGEST_PIPELINE_DEPTH: Final[int] = max(1, int(os.getenv("INGEST_PIPELINE_DEPTH", "2")))
+except ValueError:
+    INGEST_PIPELINE_DEPTH = 2
+
+# Bulk ingestion: files ingested at once per bulk job, files per request (archive members
+# included), total bytes per request before and after expanding archives, and how long
+# small embed requests from concurrent files wait to be merged into one batch
+try:
+    BULK_CONCURRENCY: Final[int] = max(1, int(os.getenv("BULK_CONCURRENCY", "4")))
+except ValueError:
+    BULK_CONCURRENCY = 4
+try:
+    BULK_MAX_FILES: Final[int] = max(1, int(os.getenv("BULK_MAX_FILES", "10000")))
+except ValueError:
+    BULK_MAX_FILES = 10000
+try:
+    BULK_MAX_TOTAL_MB: Final[int] = max(1, int(os.getenv("BULK_MAX_TOTAL_MB", "1024")))
+except ValueError:
+    BULK_MAX_TOTAL_MB = 1024
+BULK_MAX_TOTAL_BYTES: Final[int] = BULK_MAX_TOTAL_MB * 1024 * 1024
+try:
+    EMBED_COALESCE_MS: Final[int] = max(0, int(os.getenv("EMBED_COALESCE_MS", "20")))
+except ValueError:
+    EMBED_COALESCE_MS = 20
+
+# Content-addressed embedding cache: in-memory LRU entries and a durable SQLite file
+# (set EMBED_CACHE_DB to an empty string to keep the cache in memory only)
+try:
+    EMBED_CACHE_SIZE: Final[int] = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+except ValueError:
+    EMBED_CACHE_SIZE = 10000
+_embed_cache_db = os.getenv("EMBED_CACHE_DB", str(DATA_DIR / "embeddings.sqlite")).strip()
+EMBED_CACHE_DB: Final[Path | None] = Path(_embed_cache_db) if _embed_cache_db else None
+# Rows kept in EMBED_CACHE_DB (0 = unbounded); the least recently used are pruned past it
+try:
+    EMBED_CACHE_DB_MAX_ROWS: Final[int] = max(0, int(os.getenv("EMBED_CACHE_DB_MAX_ROWS", "500000")))
+except ValueError:
+    EMBED_CACHE_DB_MAX_ROWS = 500000
+
+# Query embeddings for /ask: in-memory LRU entries (0 disables), their lifetime, and whether
+# misses also go through EMBED_CACHE_DB so workers sharing that file share query embeddings
+try:
+    QUERY_EMBED_CACHE_SIZE: Final[int] = max(0, int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1000")))
+except ValueError:
+    QUERY_EMBED_CACHE_SIZE = 1000
+try:
+    QUERY_EMBED_CACHE_TTL_SECONDS: Final[int] = int(os.getenv("QUERY_EMBED_CACHE_TTL_SECONDS", "3600"))
+except ValueError:
+    QUERY_EMBED_CACHE_TTL_SECONDS = 3600
+QUERY_EMBED_CACHE_SHARED: Final[bool] = os.getenv("QUERY_EMBED_CACHE_SHARED", "true").lower() == "true"
+
+# Prompt context for /ask: estimated tokens of retrieved text packed into each prompt
+# (7000 ≈ the 8 full 3500-character chunks sent before packing)
+try:
+    CONTEXT_TOKEN_BUDGET: Final[int] = max(1, int(os.getenv("CONTEXT_TOKEN_BUDGET", "7000")))
+except ValueError:
+    CONTEXT_TOKEN_BUDGET = 7000
+
+# MMR diversity reranking for /ask (off unless MMR_ENABLED=true or the request sets mmr):
+# relevance vs. diversity weight (1.0 = plain nearest neighbours) and candidates fetched per slot
+MMR_ENABLED: Final[bool] = os.getenv("MMR_ENABLED", "false").lower() == "true"
+try:
+    MMR_LAMBDA: Final[float] = min(1.0, max(0.0, float(os.getenv("MMR_LAMBDA", "0.7"))))
+except ValueError:
+    MMR_LAMBDA = 0.7
+try:
+    MMR_FETCH_FACTOR: Final[int] = max(1, int(os.getenv("MMR_FETCH_FACTOR", "3")))
+except ValueError:
+    MMR_FETCH_FACTOR = 3
+
+# Semantic answer cache: answers kept in process memory (0 disables), their lifetime, and
+# the query-embedding cosine similarity at which a new question reuses a stored answer
+try:
+    ANSWER_CACHE_SIZE: Final[int] = max(0, int(os.getenv("ANSWER_CACHE_SIZE", "1000")))
+except ValueError:
+    ANSWER_CACHE_SIZE = 1000
+try:
+    ANSWER_CACHE_TTL_SECONDS: Final[int] = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+except ValueError:
+    ANSWER_CACHE_TTL_SECONDS = 3600
+try:
+    ANSWER_CACHE_THRESHOLD: Final[float] = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+except ValueError:
+    ANSWER_CACHE_THRESHOLD = 0.95
+
 # Database configuration (Neon Postgres)
 DATABASE_URL: Final[str | None] = os.getenv("DATABASE_URL")
 try:
@@ -60,6 +232,61 @@ try:
 except ValueError:
     EMBEDDING_DIM = 768
 USE_JSON_VECTOR_STORE: Final[bool] = os.getenv("USE_JSON_VECTOR_STORE", "false").lower() == "true"
+# Local (non-pgvector) backend: "mmap" binary segments under VEC_DIR, or legacy "json" vec.json
+LOCAL_VECTOR_STORE: Final[str] = os.getenv("LOCAL_VECTOR_STORE", "mmap").lower()
+# In-process per-chat index cache for the mmap store (0 disables)
+try:
+    VECTOR_CACHE_MB: Final[int] = int(os.getenv("VECTOR_CACHE_MB", "256"))
+except ValueError:
+    VECTOR_CACHE_MB = 256
+# Background compaction of the mmap store once it has more segments than this
+try:
+    VECTOR_COMPACT_SEGMENTS: Final[int] = int(os.getenv("VECTOR_COMPACT_SEGMENTS", "16"))
+except ValueError:
+    VECTOR_COMPACT_SEGMENTS = 16
+
+# pgvector chunk writes: "copy" (binary COPY into a staging table, then merge) or
+# "insert" (multi-row INSERT ... ON CONFLICT); rows per COPY/INSERT batch
+VECTOR_UPSERT_MODE: Final[str] = os.getenv("VECTOR_UPSERT_MODE", "copy").lower()
+try:
+    VECTOR_UPSERT_BATCH_SIZE: Final[int] = max(1, int(os.getenv("VECTOR_UPSERT_BATCH_SIZE", "5000")))
+except ValueError:
+    VECTOR_UPSERT_BATCH_SIZE = 5000
+
+# Approximate nearest-neighbour index on chunks.embedding (pgvector): "hnsw" or "ivfflat".
+# Index type and build parameters are read when the migration runs.
+VECTOR_INDEX_TYPE: Final[str] = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+try:
+    HNSW_M: Final[int] = int(os.getenv("HNSW_M", "16"))
+except ValueError:
+    HNSW_M = 16
+try:
+    HNSW_EF_CONSTRUCTION: Final[int] = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+except ValueError:
+    HNSW_EF_CONSTRUCTION = 64
+try:
+    IVFFLAT_LISTS: Final[int] = int(os.getenv("IVFFLAT_LISTS", "100"))
+except ValueError:
+    IVFFLAT_LISTS = 100
+# Query-time recall/latency knobs; /ask may override them per request (efSearch, probes)
+try:
+    HNSW_EF_SEARCH: Final[int] = int(os.getenv("HNSW_EF_SEARCH", "40"))
+except ValueError:
+    HNSW_EF_SEARCH = 40
+try:
+    IVFFLAT_PROBES: Final[int] = int(os.getenv("IVFFLAT_PROBES", "10"))
+except ValueError:
+    IVFFLAT_PROBES = 10
+
+# pgvector >= 0.8 iterative index scans keep filtered (per-chat) ANN queries from
+# returning short result sets, e.g. "relaxed_order". Empty leaves the server default.
+VECTOR_ITERATIVE_SCAN: Final[str] = os.getenv("VECTOR_ITERATIVE_SCAN", "").strip().lower()
+# Hash-partition chunks by chat_id into this many partitions (0 = plain table).
+# Read when the chat_id migration runs.
+try:
+    CHUNKS_HASH_PARTITIONS: Final[int] = int(os.getenv("CHUNKS_HASH_PARTITIONS", "0"))
+except ValueError:
+    CHUNKS_HASH_PARTITIONS = 0
 
 # Auth/session configuration
 SESSION_COOKIE_NAME: Final[str] = os.getenv("SESSION_COOKIE_NAME", "session")
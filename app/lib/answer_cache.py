@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from app import config
+from app.lib.vectors import l2_normalize
+
+
+# Fewest chats whose generation is tracked individually (see AnswerCache.invalidate)
+_MIN_TRACKED_CHATS = 1024
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    sources: List[dict]
+    vector: np.ndarray  # L2-normalized query embedding
+    params: Hashable  # retrieval settings the answer was produced with
+    created_at: float = field(default_factory=time.monotonic)
+    similarity: float = 1.0  # set on a hit: how close the new question was
+
+
+class AnswerCache:
+    """Per-chat semantic cache of generated answers.
+
+    A question reuses a stored answer from the same chat when their query
+    embeddings have cosine similarity of at least ``threshold`` and the
+    retrieval settings match. Entries expire after ``ttl_seconds`` and the
+    least recently used are evicted past ``max_entries`` (across all chats).
+    Any document change in a chat drops its entries; the per-chat generation
+    makes an answer computed across such a change unstorable. Generations
+    come from one increasing counter and only the most recently invalidated
+    chats keep their own; the rest share the highest generation forgotten so
+    far, so a stale token can never match again.
+
+    Entries and generations are per process: a document change handled by
+    one worker does not invalidate another worker's answers, which stay
+    servable until they expire. Only correct with a single worker; set
+    ANSWER_CACHE_SIZE=0 when running several.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, threshold: float) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int], CachedAnswer]" = OrderedDict()
+        self._by_chat: Dict[str, Dict[int, CachedAnswer]] = {}
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._generation_floor = 0
+        self._clock = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def generation(self, chat_id: str) -> int:
+        """Token to pass to ``put``; it changes whenever the chat is invalidated."""
+        with self._lock:
+            return self._generations.get(chat_id, self._generation_floor)
+
+    def get(self, chat_id: str, query_vec: List[float], params: Hashable) -> Optional[CachedAnswer]:
+        if not self.enabled:
+            return None
+        q = l2_normalize(np.asarray(query_vec, dtype=np.float32))
+        with self._lock:
+            entries = self._by_chat.get(chat_id)
+            if not entries:
+                self.misses += 1
+                return None
+            cutoff = time.monotonic() - self.ttl_seconds
+            for entry_id in [i for i, e in entries.items() if e.created_at < cutoff]:
+                self._drop(chat_id, entry_id)
+            candidates = [(i, e) for i, e in entries.items() if e.params == params and e.vector.shape == q.shape]
+            if not candidates:
+                self.misses += 1
+                return None
+            scores = np.stack([e.vector for _, e in candidates]) @ q
+            best = int(np.argmax(scores))
+            if float(scores[best]) < self.threshold:
+                self.misses += 1
+                return None
+            entry_id, entry = candidates[best]
+            self._entries.move_to_end((chat_id, entry_id))
+            self.hits += 1
+            return CachedAnswer(
+                query=entry.query,
+                answer=entry.answer,
+                sources=entry.sources,
+                vector=entry.vector,
+                params=entry.params,
+                created_at=entry.created_at,
+                similarity=float(scores[best]),
+            )
+
+    def put(
+        self,
+        chat_id: str,
+        generation: int,
+        *,
+        query: str,
+        query_vec: List[float],
+        params: Hashable,
+        answer: str,
+        sources: List[dict],
+    ) -> None:
+        if not self.enabled:
+            return
+        vector = l2_normalize(np.asarray(query_vec, dtype=np.float32))
+        with self._lock:
+            if self._generations.get(chat_id, self._generation_floor) != generation:
+                return  # documents changed while this answer was being produced
+            entry_id = self._next_id
+            self._next_id += 1
+            entry = CachedAnswer(query=query, answer=answer, sources=sources, vector=vector, params=params)
+            self._by_chat.setdefault(chat_id, {})[entry_id] = entry
+            self._entries[(chat_id, entry_id)] = entry
+            while len(self._entries) > self.max_entries:
+                (old_chat, old_id), _ = next(iter(self._entries.items()))
+                self._drop(old_chat, old_id)
+
+    def invalidate(self, chat_id: str) -> None:
+        """Forget every answer in the chat (its documents changed)."""
+        with self._lock:
+            self._clock += 1
+            self._generations[chat_id] = self._clock
+            self._generations.move_to_end(chat_id)
+            while len(self._generations) > max(self.max_entries, _MIN_TRACKED_CHATS):
+                _, forgotten = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, forgotten)
+            for entry_id in list(self._by_chat.get(chat_id, {})):
+                self._drop(chat_id, entry_id)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _drop(self, chat_id: str, entry_id: int) -> None:
+        self._entries.pop((chat_id, entry_id), None)
+        entries = self._by_chat.get(chat_id)
+        if entries is not None:
+            entries.pop(entry_id, None)
+            if not entries:
+                del self._by_chat[chat_id]
+
+
+answer_cache = AnswerCache(config.ANSWER_CACHE_SIZE, config.ANSWER_CACHE_TTL_SECONDS, config.ANSWER_CACHE_THRESHOLD)
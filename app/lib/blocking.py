@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+from fastapi import HTTPException, status
+
+from app import config
+
+
+T = TypeVar("T")
+
+_provider_pool = ThreadPoolExecutor(max_workers=config.PROVIDER_CONCURRENCY, thread_name_prefix="provider")
+_provider_slots = asyncio.Semaphore(config.PROVIDER_CONCURRENCY)
+
+
+async def run_provider_call(fn: Callable[..., T], *args: object, timeout: Optional[float] = None) -> T:
+    """Run a blocking embedding/generation call off the event loop.
+
+    At most PROVIDER_CONCURRENCY calls run at once per process; callers beyond
+    that wait on the loop without holding a thread. The timeout (default
+    PROVIDER_TIMEOUT_SECONDS) starts once a slot is acquired and maps to 504.
+    """
+    limit = config.PROVIDER_TIMEOUT_SECONDS if timeout is None else timeout
+    async with _provider_slots:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_provider_pool, functools.partial(fn, *args))
+        try:
+            return await asyncio.wait_for(future, limit)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Model provider timed out.",
+            )
+
+
+async def stream_provider_call(
+    fn: Callable[..., Iterator[T]], *args: object, timeout: Optional[float] = None
+) -> AsyncIterator[T]:
+    """Run a blocking generator (e.g. a streamed generation) off the event loop.
+
+    Items are handed to the loop as the provider produces them. One
+    PROVIDER_CONCURRENCY slot is held until the stream ends; the timeout
+    (default PROVIDER_TIMEOUT_SECONDS) applies to each wait for the next item
+    and maps to 504. Closing the iterator early stops the worker thread after
+    its current item.
+    """
+    limit = config.PROVIDER_TIMEOUT_SECONDS if timeout is None else timeout
+    async with _provider_slots:
+        loop = asyncio.get_running_loop()
+        items: "asyncio.Queue[tuple[bool, object]]" = asyncio.Queue()
+        stop = threading.Event()
+
+        def send(ok: bool, item: object) -> None:
+            try:
+                loop.call_soon_threadsafe(items.put_nowait, (ok, item))
+            except RuntimeError:
+                pass  # loop already closed
+
+        def pump() -> None:
+            try:
+                for item in fn(*args):
+                    if stop.is_set():
+                        return
+                    send(True, item)
+            except BaseException as exc:
+                send(False, exc)
+                return
+            send(False, None)
+
+        loop.run_in_executor(_provider_pool, pump)
+        try:
+            while True:
+                try:
+                    ok, item = await asyncio.wait_for(items.get(), limit)
+                except asyncio.TimeoutError:
+                    raise HTTPException(
+                        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                        detail="Model provider timed out.",
+                    )
+                if ok:
+                    yield item  # type: ignore[misc]
+                elif item is None:
+                    return
+                else:
+                    raise item  # type: ignore[misc]
+        finally:
+            stop.set()
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import tarfile
+import tempfile
+import zipfile
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import IO, AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException, status
+
+from app import config
+from app.lib.embeddings import EmbedBatcher
+from app.lib.jobs import IngestJob
+from app.lib.logger import get_logger
+from app.lib.pipeline import create_pending_documents, discard_document, generate_document_id, ingest_document
+from app.lib.uploads import BLOCK_BYTES, spool_dir
+
+
+logger = get_logger("rag.bulk")
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+@dataclass
+class BulkFile:
+    filename: str
+    path: Path
+    size_bytes: int
+    content_hash: str
+    document_id: str = ""
+    # Index of an earlier file in the same request with identical bytes
+    duplicate_of: Optional[int] = None
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class BulkLimits:
+    """Running file-count and byte totals for one bulk request (BULK_MAX_FILES, BULK_MAX_TOTAL_MB)."""
+
+    def __init__(self) -> None:
+        self.parts = 0
+        self.files = 0
+        self.bytes = 0
+
+    def add_part(self) -> None:
+        """Count an uploaded file part; archives count here as well as per member."""
+        self.parts += 1
+        if self.parts > config.BULK_MAX_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many files. Max {config.BULK_MAX_FILES} per request.",
+            )
+
+    def add_file(self) -> None:
+        self.files += 1
+        if self.files > config.BULK_MAX_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many files. Max {config.BULK_MAX_FILES} per request.",
+            )
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes += n
+        if self.bytes > config.BULK_MAX_TOTAL_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Upload too large. Max {config.BULK_MAX_TOTAL_MB}MB per request after extraction.",
+            )
+
+    async def counted(self, blocks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass an upload's blocks through, adding each to the byte total as it arrives."""
+        async for block in blocks:
+            self.add_bytes(len(block))
+            yield block
+
+
+def _member_name(name: str) -> Optional[str]:
+    """Normalized path of an archive member, or None for entries that are not documents."""
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("/", ".", "..")]
+    if not parts or parts[0] == "__MACOSX" or parts[-1].startswith("."):
+        return None
+    return "/".join(parts)
+
+
+def _spool_member(source: IO[bytes], filename: str, limits: BulkLimits) -> BulkFile:
+    """Copy one archive member to a spool file, counting real (not declared) sizes."""
+    fd, name = tempfile.mkstemp(dir=spool_dir(), suffix=PurePosixPath(filename).suffix)
+    path = Path(name)
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for block in iter(lambda: source.read(BLOCK_BYTES), b""):
+                size += len(block)
+                if size > config.MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"{filename} is too large. Max {config.MAX_UPLOAD_MB}MB per file.",
+                    )
+                limits.add_bytes(len(block))
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return BulkFile(filename=filename, path=path, size_bytes=size, content_hash=digest.hexdigest())
+
+
+def expand_archive(filename: str, path: Path, limits: BulkLimits) -> List[BulkFile]:
+    """Extract the regular files of a zip or tar archive into spool files.
+
+    Nothing is written under member names, so paths like ``../x`` cannot
+    escape the spool directory. Links, directories and hidden files are
+    skipped, nested archives are not opened, and sizes are checked as bytes
+    are read so a bomb stops at the limit. Blocking; run it in a thread.
+    """
+    out: List[BulkFile] = []
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    name = _member_name(info.filename)
+                    if info.is_dir() or name is None:
+                        continue
+                    limits.add_file()
+                    with archive.open(info) as source:
+                        out.append(_spool_member(source, name, limits))
+        else:
+            with tarfile.open(path, "r:*") as archive:
+                for member in archive:
+                    name = _member_name(member.name)
+                    if not member.isreg() or name is None:
+                        continue
+                    limits.add_file()
+                    source = archive.extractfile(member)
+                    if source is None:
+                        continue
+                    with source:
+                        out.append(_spool_member(source, name, limits))
+    except (zipfile.BadZipFile, tarfile.TarError, RuntimeError, EOFError, OSError):
+        for item in out:
+            item.path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Could not read archive {filename}.",
+        )
+    except BaseException:
+        for item in out:
+            item.path.unlink(missing_ok=True)
+        raise
+    return out
+
+
+def assign_documents(files: List[BulkFile]) -> None:
+    """Give each file a document id; repeats of earlier bytes point at the first copy."""
+    first: Dict[str, int] = {}
+    for index, item in enumerate(files):
+        seen = first.setdefault(item.content_hash, index)
+        if seen != index:
+            item.duplicate_of = seen
+            item.document_id = files[seen].document_id
+        else:
+            item.document_id = generate_document_id()
+
+
+async def create_pending(files: List[BulkFile], *, chat_id: str, user_id: str) -> None:
+    """Record a pending Document for each file that will be ingested, so listings show the whole batch."""
+    await create_pending_documents(
+        [
+            (item.document_id, item.filename, item.size_bytes, item.content_hash)
+            for item in files
+            if item.duplicate_of is None
+        ],
+        chat_id=chat_id,
+        uploader_user_id=user_id,
+    )
+
+
+async def discard_pending(files: List[BulkFile], *, chat_id: str) -> None:
+    for item in files:
+        if item.duplicate_of is None:
+            await discard_document(item.document_id, chat_id=chat_id)
+
+
+async def run_bulk(job: IngestJob, files: List[BulkFile], *, chat_id: str, user_id: str) -> Dict[str, object]:
+    """Ingest ``files`` with BULK_CONCURRENCY at a time; one failure does not stop the rest.
+
+    Each file's pending Document (``create_pending``) is marked indexed on
+    success and removed on failure. All files share an ``EmbedBatcher``, so the small embed requests of many
+    short documents go to the provider as full batches.
+    Returns: { ok, files: [ per-file result ], succeeded, failed }
+    """
+    batcher = EmbedBatcher()
+    results: List[Optional[Dict[str, object]]] = [None] * len(files)
+    todo = deque(i for i, item in enumerate(files) if item.duplicate_of is None)
+    total = len(todo)
+    finished = 0
+    job.progress("ingest", 0, total)
+
+    async def ingest_one(index: int) -> None:
+        item = files[index]
+        try:
+            try:
+                result = await ingest_document(
+                    filename=item.filename,
+                    path=item.path,
+                    chat_id=chat_id,
+                    uploader_user_id=user_id,
+                    document_id=item.document_id,
+                    size_bytes=item.size_bytes,
+                    content_hash=item.content_hash,
+                    embed=batcher.embed,
+                    pending=True,
+                )
+            except BaseException:
+                await discard_document(item.document_id, chat_id=chat_id)
+                raise
+            results[index] = {"filename": item.filename, **result}
+        except HTTPException as exc:
+            results[index] = {"filename": item.filename, "ok": False, "error": str(exc.detail)}
+        except Exception:
+            logger.exception("bulk ingest of %s failed", item.filename)
+            results[index] = {"filename": item.filename, "ok": False, "error": "Ingestion failed."}
+        finally:
+            item.path.unlink(missing_ok=True)
+
+    async def worker() -> None:
+        nonlocal finished
+        while todo:
+            await ingest_one(todo.popleft())
+            finished += 1
+            job.progress("ingest", finished, total)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(config.BULK_CONCURRENCY, total))))
+    finally:
+        for item in files:
+            item.path.unlink(missing_ok=True)
+        # Files not started when the job was cancelled must not stay listed as pending.
+        await discard_pending([files[index] for index in todo], chat_id=chat_id)
+
+    for index, item in enumerate(files):
+        if item.duplicate_of is None:
+            continue
+        original = results[item.duplicate_of] or {}
+        if original.get("ok"):
+            results[index] = {
+                "filename": item.filename,
+                "ok": True,
+                "documentId": original.get("documentId"),
+                "chunks": original.get("chunks"),
+                "duplicate": True,
+            }
+        else:
+            results[index] = {"filename": item.filename, "ok": False, "error": original.get("error")}
+    succeeded = sum(1 for r in results if r and r.get("ok"))
+    logger.info("bulk ingest into chat %s: %d of %d files indexed", chat_id, succeeded, len(files))
+    return {"ok": True, "files": results, "succeeded": succeeded, "failed": len(files) - succeeded}
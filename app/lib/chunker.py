@@ -1,11 +1,43 @@
 from __future__ import annotations
 
-from typing import List
+from typing import Iterable, Iterator, List
 
 CHUNK_SIZE = 3500
 CHUNK_OVERLAP = 600
 
 
+def iter_chunks(
+    pieces: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> Iterator[str]:
+    """Yield overlapping chunks from text arriving in pieces.
+
+    Produces exactly what ``chunk_text("".join(pieces))`` returns, but emits
+    each chunk as soon as enough text has arrived, holding at most about one
+    chunk plus the current piece in memory.
+    """
+    buf = ""
+    start = 0
+    started = False
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        if start:
+            buf = buf[start:]
+            start = 0
+        buf += piece
+        # Trailing whitespace only counts once more text follows it.
+        end = len(buf.rstrip())
+        while start + chunk_size < end:
+            yield buf[start : start + chunk_size]
+            start = max(0, start + chunk_size - overlap)
+    tail = buf[start:].rstrip()
+    if tail:
+        yield tail
+
+
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Split text into chunks with overlap.
 
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app import config
+from app.lib.chunker import CHUNK_OVERLAP
+
+
+Row = Dict[str, object]
+
+# Characters per token for English prose with Gemini/BPE-style tokenizers.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (length / CHARS_PER_TOKEN, rounded up); no tokenizer call."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+@dataclass
+class ContextBlock:
+    """A run of adjacent chunks from one document, with repeated overlap removed."""
+
+    document_id: str
+    filename: Optional[str]
+    chunk_ids: List[int] = field(default_factory=list)
+    text: str = ""
+    score: float = 0.0  # best score among its chunks
+
+
+def _shared_overlap(prev: str, nxt: str, overlap: int) -> int:
+    """Length of the chunker overlap repeated at the start of ``nxt``, or 0 if it is not there."""
+    n = min(overlap, len(prev), len(nxt))
+    return n if n and prev.endswith(nxt[:n]) else 0
+
+
+def build_context(
+    results: List[Tuple[Row, float]],
+    *,
+    budget_tokens: Optional[int] = None,
+    overlap: int = CHUNK_OVERLAP,
+) -> List[ContextBlock]:
+    """Pack ranked search results into at most ``budget_tokens`` of context.
+
+    Chunks are taken best first. A chunk next to one already taken from the
+    same document only costs its text beyond the shared overlap; a chunk that
+    does not fit is skipped in favour of smaller ones further down. Taken
+    chunks are then merged into one block per run of consecutive chunk ids,
+    and blocks are ordered by their best score. If even the best chunk is
+    over budget it is cut to fit, so the context is never empty when there
+    are results.
+    """
+    budget = config.CONTEXT_TOKEN_BUDGET if budget_tokens is None else budget_tokens
+    taken: Dict[Tuple[str, int], Tuple[Row, float]] = {}
+    used = 0
+    for row, score in results:
+        key = (str(row.get("documentId")), int(row.get("chunkId", 0)))  # type: ignore[arg-type]
+        if key in taken:
+            continue
+        text = str(row.get("text", ""))
+        cost = len(text)
+        before = taken.get((key[0], key[1] - 1))
+        after = taken.get((key[0], key[1] + 1))
+        if before is not None:
+            cost -= _shared_overlap(str(before[0].get("text", "")), text, overlap)
+        if after is not None:
+            cost -= _shared_overlap(text, str(after[0].get("text", "")), overlap)
+        tokens = estimate_tokens(text[:cost]) if cost > 0 else 0
+        if used + tokens <= budget:
+            taken[key] = (row, score)
+            used += tokens
+        elif not taken and budget > 0:
+            taken[key] = ({**row, "text": text[: budget * CHARS_PER_TOKEN]}, score)
+            break
+
+    blocks: List[ContextBlock] = []
+    for (document_id, chunk_id), (row, score) in sorted(taken.items()):
+        text = str(row.get("text", ""))
+        last = blocks[-1] if blocks else None
+        if last is not None and last.document_id == document_id and last.chunk_ids[-1] == chunk_id - 1:
+            cut = _shared_overlap(last.text, text, overlap)
+            last.text += text[cut:] if cut else "\n" + text
+            last.chunk_ids.append(chunk_id)
+            last.score = max(last.score, score)
+            continue
+        filename = row.get("filename")
+        blocks.append(
+            ContextBlock(
+                document_id=document_id,
+                filename=str(filename) if filename is not None else None,
+                chunk_ids=[chunk_id],
+                text=text,
+                score=score,
+            )
+        )
+    blocks.sort(key=lambda b: b.score, reverse=True)
+    return blocks
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app import config
+
+
+# Rows written between checks of the durable table against its row cap
+_PRUNE_EVERY = 1000
+# Pruning goes this far below the cap, so it does not run on every check
+_PRUNE_TO = 0.9
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU over a durable SQLite file.
+
+    Keys are SHA-256 digests of (embedding model, text), so identical chunk
+    text is only ever embedded once per model, across uploads, chats and
+    restarts. Vectors are stored as float32 blobs, the precision the API
+    returns. The durable table keeps at most ``max_rows`` rows (0 = no cap),
+    pruning those least recently written or read from the file.
+    """
+
+    def __init__(self, path: Optional[Path], max_entries: int, max_rows: int = 0) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.max_rows = max(0, int(max_rows))
+        self._unpruned = 0
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "used_at" not in columns:
+                # Files from before the row cap: existing rows count as least recently used.
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS query_embeddings_stored_at ON query_embeddings (stored_at)"
+            )
+            self._prune()
+
+    @staticmethod
+    def key(text: str, model: str) -> bytes:
+        return hashlib.sha256(model.encode("utf-8") + b"\0" + text.encode("utf-8")).digest()
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, List[float]]:
+        wanted = list(dict.fromkeys(keys))
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            for key in wanted:
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vec
+            missing = [k for k in wanted if k not in found]
+            if missing and self._db is not None:
+                read: List[bytes] = []
+                for start in range(0, len(missing), 500):
+                    part = missing[start : start + 500]
+                    marks = ",".join("?" * len(part))
+                    rows = self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part)
+                    for key, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[bytes(key)] = vec
+                        read.append(bytes(key))
+                        self._remember(bytes(key), vec)
+                if read and self.max_rows:
+                    now = time.time()
+                    self._db.executemany("UPDATE embeddings SET used_at = ? WHERE key = ?", [(now, k) for k in read])
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            for key, vec in items.items():
+                self._remember(key, vec)
+            if self._db is not None:
+                now = time.time()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, used_at) VALUES (?, ?, ?)",
+                    [(key, np.asarray(vec, dtype=np.float32).tobytes(), now) for key, vec in items.items()],
+                )
+                self._unpruned += len(items)
+                if self._unpruned >= _PRUNE_EVERY:
+                    self._prune()
+
+    def get_recent(self, key: bytes, max_age: float) -> Optional[Tuple[float, List[float]]]:
+        """(stored_at, vector) of an entry written by ``put_recent`` at most ``max_age`` seconds ago.
+
+        These expiring entries live in their own table and only on disk; the
+        caller keeps its own memory tier.
+        """
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT stored_at, vector FROM query_embeddings WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - max_age),
+            ).fetchone()
+        if row is None:
+            return None
+        return float(row[0]), np.frombuffer(row[1], dtype=np.float32).tolist()
+
+    def put_recent(self, key: bytes, vec: List[float], max_age: float) -> None:
+        """Store an expiring entry (wall-clock stamped, so workers agree); purges expired ones."""
+        if self._db is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM query_embeddings WHERE stored_at < ?", (now - max_age,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                (key, np.asarray(vec, dtype=np.float32).tobytes(), now),
+            )
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memoryEntries": len(self._memory),
+                "durable": self._db is not None,
+                "maxRows": self.max_rows,
+            }
+
+    def _prune(self) -> None:
+        """Delete the least recently used durable rows once there are more than ``max_rows``.
+
+        Counts the whole table, so rows written by other workers sharing the
+        file are included. Called with the lock held (or from __init__).
+        """
+        self._unpruned = 0
+        if self._db is None or not self.max_rows:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_rows:
+            return
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)",
+            (count - int(self.max_rows * _PRUNE_TO),),
+        )
+
+    def _remember(self, key: bytes, vec: List[float]) -> None:
+        if not self.max_entries:
+            return
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+class QueryEmbeddingCache:
+    """LRU cache with TTL for query embeddings, keyed by normalized query and model.
+
+    Queries are normalized by case and whitespace, so retries, double submits
+    and common questions share an entry. It is consulted on the event loop,
+    so a hit costs no provider slot or thread hop. With ``shared`` a miss
+    falls through to the expiring query table of ``EmbeddingCache``, which
+    workers pointed at the same EMBED_CACHE_DB file share; the TTL counts
+    from when any worker stored the entry.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, shared: Optional[EmbeddingCache] = None) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[bytes, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, model: str) -> bytes:
+        normalized = " ".join(query.split()).casefold()
+        return hashlib.sha256(b"query\0" + model.encode("utf-8") + b"\0" + normalized.encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        """Memory tier only; safe to call on the event loop."""
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._memory[key]
+            return None
+
+    def get_shared(self, key: bytes) -> Optional[List[float]]:
+        """Shared tier (blocking: may read SQLite); refills the memory tier on a hit."""
+        found = self.shared.get_recent(key, self.ttl_seconds) if self.shared is not None else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        stored_at, vec = found
+        self._remember(key, vec, age=max(0.0, time.time() - stored_at))
+        return vec
+
+    def put(self, key: bytes, vec: List[float]) -> None:
+        self._remember(key, vec)
+        if self.shared is not None:
+            self.shared.put_recent(key, vec, self.ttl_seconds)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memoryEntries": len(self._memory),
+                "shared": self.shared is not None,
+            }
+
+    def _remember(self, key: bytes, vec: List[float], age: float = 0.0) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._memory[key] = (time.monotonic() + self.ttl_seconds - age, vec)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+embedding_cache = EmbeddingCache(config.EMBED_CACHE_DB, config.EMBED_CACHE_SIZE, config.EMBED_CACHE_DB_MAX_ROWS)
+query_embedding_cache = QueryEmbeddingCache(
+    config.QUERY_EMBED_CACHE_SIZE,
+    config.QUERY_EMBED_CACHE_TTL_SECONDS,
+    embedding_cache if config.QUERY_EMBED_CACHE_SHARED else None,
+)
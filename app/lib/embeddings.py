@@ -1,48 +1,150 @@
 from __future__ import annotations
 
-from typing import List
-
-import google.generativeai as genai
-from fastapi import HTTPException, status
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 from app import config
+from app.lib.blocking import run_provider_call
+from app.lib.embedding_cache import embedding_cache, query_embedding_cache
+from app.lib.providers import get_provider
 
 
-def _ensure_api_key() -> None:
-    if not config.GOOGLE_API_KEY:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Missing GOOGLE_API_KEY. Please set it in the environment.",
-        )
+# Shared across requests so EMBED_CONCURRENCY caps in-flight batches per process.
+_batch_pool = ThreadPoolExecutor(max_workers=config.EMBED_CONCURRENCY, thread_name_prefix="embed")
 
 
 def embed_texts(texts: List[str]) -> List[List[float]]:
     """Embed multiple texts into vector embeddings.
 
-    Raises an HTTPException with friendly message if the API key is missing.
+    Texts already in the embedding cache are served from it. The rest are
+    de-duplicated and sent in batches of EMBED_BATCH_SIZE, with up to
+    EMBED_CONCURRENCY batches in flight; results keep input order and blank
+    texts map to an empty list. Provider errors (e.g. a missing API key) are
+    raised as HTTPException.
     """
-    _ensure_api_key()
-    genai.configure(api_key=config.GOOGLE_API_KEY)
+    provider = get_provider()
+    results: List[List[float]] = [[] for _ in texts]
+    keys: Dict[int, bytes] = {
+        i: embedding_cache.key(t, provider.embedding_model) for i, t in enumerate(texts) if t.strip()
+    }
+    cached = embedding_cache.get_many(keys.values())
 
-    results: List[List[float]] = []
-    for t in texts:
-        try:
-            if not t.strip():
-                results.append([])
-                continue
-            res = genai.embed_content(model=config.EMBEDDING_MODEL, content=t)
-            vec = res.get("embedding") or res.get("data", [{}])[0].get("embedding")
-            if not vec:
-                raise HTTPException(status_code=500, detail="Failed to embed content.")
-            results.append(vec)  # type: ignore[arg-type]
-        except HTTPException:
-            raise
-        except Exception:
-            raise HTTPException(status_code=500, detail="Embedding service error.")
+    # One request per distinct uncached text.
+    todo: Dict[bytes, str] = {}
+    for i, key in keys.items():
+        if key not in cached:
+            todo.setdefault(key, texts[i])
+    if todo:
+        pending = list(todo.items())
+        size = config.EMBED_BATCH_SIZE
+        batches = [pending[i : i + size] for i in range(0, len(pending), size)]
+        if len(batches) == 1:
+            outputs = [provider.embed_batch([t for _, t in batches[0]])]
+        else:
+            outputs = list(_batch_pool.map(lambda batch: provider.embed_batch([t for _, t in batch]), batches))
+        fresh = {key: vec for batch, vecs in zip(batches, outputs) for (key, _), vec in zip(batch, vecs)}
+        embedding_cache.put_many(fresh)
+        cached.update(fresh)
+
+    for i, key in keys.items():
+        results[i] = cached[key]
     return results
 
 
 def embed_query(text: str) -> List[float]:
-    """Embed a single query string."""
-    vecs = embed_texts([text])
-    return vecs[0]
+    """Embed a single query string, through the query embedding cache.
+
+    Misses go straight to the provider: query embeddings only live in the
+    expiring query cache, never in the durable chunk embedding cache.
+    """
+    if not text.strip():
+        return []
+    provider = get_provider()
+    key = query_embedding_cache.key(text, provider.embedding_model)
+    vec = query_embedding_cache.get(key) or query_embedding_cache.get_shared(key)
+    if vec is None:
+        vec = provider.embed_batch([text])[0]
+        query_embedding_cache.put(key, vec)
+    return vec
+
+
+def cached_query_embedding(text: str) -> Optional[List[float]]:
+    """The query's embedding if the in-memory query cache has it; never blocks."""
+    return query_embedding_cache.get(query_embedding_cache.key(text, get_provider().embedding_model))
+
+
+async def embed_texts_async(texts: List[str]) -> List[List[float]]:
+    """``embed_texts`` on the provider pool, so the event loop stays free."""
+    return await run_provider_call(embed_texts, texts)
+
+
+async def embed_query_async(text: str) -> List[float]:
+    """``embed_query`` on the provider pool, so the event loop stays free.
+
+    A hit in the in-memory query cache returns without leaving the loop.
+    """
+    return cached_query_embedding(text) or await run_provider_call(embed_query, text)
+
+
+class EmbedBatcher:
+    """Merges ``embed`` calls from concurrent ingestions into fuller provider batches.
+
+    A call waits up to EMBED_COALESCE_MS for others to join it, or until
+    EMBED_BATCH_SIZE texts are pending, and then all pending texts go through
+    one ``embed_texts_async``. Each caller gets its own slice of the result.
+    If the merged call fails, each caller's texts are retried on their own,
+    so only the callers whose texts still fail get an error. Use one batcher
+    per group of related ingestions.
+    """
+
+    def __init__(self, linger_ms: Optional[int] = None) -> None:
+        self.linger = (config.EMBED_COALESCE_MS if linger_ms is None else linger_ms) / 1000.0
+        self._pending: List[Tuple[List[str], "asyncio.Future[List[List[float]]]"]] = []
+        self._count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[List[List[float]]]" = loop.create_future()
+        self._pending.append((texts, future))
+        self._count += len(texts)
+        if self._count >= config.EMBED_BATCH_SIZE or self.linger <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._count = self._pending, [], 0
+        if pending:
+            task = asyncio.create_task(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[List[str], "asyncio.Future[List[List[float]]]"]]) -> None:
+        try:
+            vectors = await embed_texts_async([t for texts, _ in pending for t in texts])
+        except BaseException as exc:
+            if len(pending) > 1 and not isinstance(exc, asyncio.CancelledError):
+                # One caller's texts may be what failed the merged call; retry
+                # each part alone so only that caller gets the error.
+                await asyncio.gather(*(self._run([item]) for item in pending))
+                return
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            return
+        offset = 0
+        for texts, future in pending:
+            if not future.done():
+                future.set_result(vectors[offset : offset + len(texts)])
+            offset += len(texts)
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from typing import AsyncIterator, Iterator
+
+from app.lib.blocking import run_provider_call, stream_provider_call
+from app.lib.providers import get_provider
+
+
+def generate_answer(prompt: str) -> str:
+    """Generate an answer for ``prompt`` with the configured provider (blocking)."""
+    return get_provider().generate(prompt)
+
+
+async def generate_answer_async(prompt: str) -> str:
+    """``generate_answer`` on the provider pool, so the event loop stays free."""
+    return await run_provider_call(generate_answer, prompt)
+
+
+def generate_answer_stream(prompt: str) -> Iterator[str]:
+    """Yield answer text for ``prompt`` as the provider produces it (blocking)."""
+    return get_provider().generate_stream(prompt)
+
+
+def stream_answer_async(prompt: str) -> AsyncIterator[str]:
+    """``generate_answer_stream`` on the provider pool, as an async iterator."""
+    return stream_provider_call(generate_answer_stream, prompt)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException
+
+from app import config
+from app.lib.uploads import BLOCK_BYTES, Spooled, spool_blocks
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the app-wide client; connections are pooled and kept alive across fetches."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=config.HTTP_TIMEOUT_SECONDS,
+            headers={"User-Agent": "rag-fastapi/1.0"},
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def fetch_to_spool(url: str) -> Spooled:
+    """Stream a URL into a spool file, stopping as soon as MAX_UPLOAD_BYTES is exceeded.
+
+    ``content_type`` on the result is the response's media type without
+    parameters, or None when absent.
+    """
+    client = get_http_client()
+    try:
+        async with client.stream("GET", url) as resp:
+            if resp.status_code != 200:
+                raise HTTPException(status_code=400, detail="Failed to fetch the file URL.")
+            length = resp.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > config.MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=400, detail=f"File too large. Max {config.MAX_UPLOAD_MB}MB.")
+            media_type = resp.headers.get("Content-Type", "").split(";", 1)[0].strip().lower() or None
+            spooled = await spool_blocks(resp.aiter_bytes(BLOCK_BYTES), suffix=Path(resp.url.path).suffix)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=400, detail="Failed to fetch the file URL.")
+    spooled.content_type = media_type
+    return spooled
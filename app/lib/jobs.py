@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, status
+
+from app import config
+from app.lib.logger import get_logger
+
+
+logger = get_logger("rag.jobs")
+
+
+def worker_id() -> str:
+    """Name this process as ``<hostname>-<pid>``; spool dirs and pending Documents carry it."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def worker_gone(worker: str) -> Optional[bool]:
+    """Whether the process named by ``worker_id`` has exited.
+
+    A previous process with this process's pid counts as gone. None when the
+    name is not one of this host's workers, so liveness cannot be checked.
+    """
+    host, _, pid = worker.rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+@dataclass
+class IngestJob:
+    """In-flight or recently finished ingestion, as reported by GET /jobs/{jobId}."""
+
+    id: str
+    user_id: str
+    chat_id: str
+    document_id: Optional[str]  # None for bulk jobs, which report one per file
+    filename: str
+    status: str = "queued"  # queued | running | succeeded | failed
+    stage: str = "queued"  # queued | fetch | parse | chunk | embed | upsert | ingest | done
+    done: int = 0
+    total: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict[str, object]] = None
+    created_at: int = field(default_factory=lambda: int(time.time()))
+    updated_at: int = field(default_factory=lambda: int(time.time()))
+
+    def progress(self, stage: str, done: int = 0, total: int = 0) -> None:
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.updated_at = int(time.time())
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "chatId": self.chat_id,
+            "documentId": self.document_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": {"done": self.done, "total": self.total},
+            "error": self.error,
+            "result": self.result,
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+        }
+
+
+JobRunner = Callable[[IngestJob], Awaitable[Dict[str, object]]]
+
+
+class JobQueue:
+    """Bounded in-process queue drained by a fixed number of asyncio workers.
+
+    Jobs live in this process only; finished jobs are kept for
+    INGEST_JOB_TTL_SECONDS so clients can poll the outcome.
+    """
+
+    def __init__(self, workers: int, max_queued: int, ttl_seconds: int) -> None:
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, IngestJob] = {}
+        self._queue: Optional["asyncio.Queue[tuple[IngestJob, JobRunner]]"] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"ingest-{i}") for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def new_job(self, *, user_id: str, chat_id: str, filename: str) -> IngestJob:
+        return IngestJob(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            chat_id=chat_id,
+            document_id=str(uuid.uuid4()),
+            filename=filename,
+        )
+
+    def submit(self, job: IngestJob, runner: JobRunner) -> IngestJob:
+        self.start()
+        self._prune()
+        assert self._queue is not None
+        try:
+            self._queue.put_nowait((job, runner))
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Ingestion queue is full. Try again later.",
+            )
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            job, runner = await queue.get()
+            job.status = "running"
+            job.updated_at = int(time.time())
+            try:
+                job.result = await runner(job)
+                # A duplicate upload resolves to the chat's existing document.
+                job.document_id = job.result.get("documentId") or job.document_id  # type: ignore[assignment]
+                job.status = "succeeded"
+                job.progress("done", job.total, job.total)
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Cancelled during shutdown."
+                raise
+            except HTTPException as exc:
+                job.status = "failed"
+                job.error = str(exc.detail)
+            except Exception:
+                logger.exception("ingest job %s failed", job.id)
+                job.status = "failed"
+                job.error = "Ingestion failed."
+            finally:
+                job.updated_at = int(time.time())
+                queue.task_done()
+
+    def _prune(self) -> None:
+        cutoff = int(time.time()) - self.ttl_seconds
+        stale = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in ("succeeded", "failed") and job.updated_at < cutoff
+        ]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+
+ingest_jobs = JobQueue(config.INGEST_WORKERS, config.INGEST_QUEUE_SIZE, config.INGEST_JOB_TTL_SECONDS)
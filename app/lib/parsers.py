@@ -1,78 +1,540 @@
 from __future__ import annotations
 
+import codecs
+import multiprocessing
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from html.parser import HTMLParser
 from io import BytesIO
-from typing import Optional
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
 
-from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
 from fastapi import HTTPException, status
 from pypdf import PdfReader
 
+from app import config
+
 
 TEXT_TYPES = {"text/plain", "text/markdown"}
 HTML_TYPES = {"text/html"}
 PDF_TYPES = {"application/pdf"}
 
+# Plain text is read from disk in blocks of this many characters
+TEXT_BLOCK_CHARS = 1024 * 1024
+# HTML is fed to the parser in blocks of this many bytes, checking the deadline in between
+HTML_BLOCK_BYTES = 256 * 1024
+# Elements whose contents are not document text (as in BeautifulSoup's get_text)
+_HTML_SKIP_TAGS = {"script", "style", "template"}
+
+
+@dataclass
+class ParseResult:
+    text: str
+    # True when a parse budget cut extraction short (PARSE_BUDGET_MODE=truncate)
+    truncated: bool = False
+
+
+class ParseBudget:
+    """Per-document limits: PARSE_MAX_PAGES, PARSE_MAX_CHARS and PARSE_DEADLINE_SECONDS.
+
+    A limit of 0 disables it. ``hit`` fails the parse (400) in "fail" mode,
+    otherwise it records that the result is partial.
+    """
+
+    def __init__(self) -> None:
+        self.max_pages = config.PARSE_MAX_PAGES
+        self.max_chars = config.PARSE_MAX_CHARS
+        # Wall clock so pool workers in other processes share the same deadline
+        self.deadline = time.time() + config.PARSE_DEADLINE_SECONDS if config.PARSE_DEADLINE_SECONDS > 0 else 0.0
+        self.truncated = False
+
+    def remaining(self) -> Optional[float]:
+        return max(0.0, self.deadline - time.time()) if self.deadline else None
+
+    def expired(self) -> bool:
+        return bool(self.deadline) and time.time() >= self.deadline
+
+    def extend(self, seconds: float) -> None:
+        """Push the deadline back, e.g. for time a consumer kept the parser waiting."""
+        if self.deadline:
+            self.deadline += seconds
+
+    def hit(self, what: str) -> None:
+        if config.PARSE_BUDGET_MODE == "fail":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Document exceeds the parse {what} budget.",
+            )
+        self.truncated = True
+
+    def lost(self) -> None:
+        """Pages could not be extracted at all (e.g. a parser process kept crashing).
+
+        Fails the parse (400) in "fail" mode, otherwise keeps what was
+        extracted before them as a partial result.
+        """
+        if config.PARSE_BUDGET_MODE == "fail":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Part of the document could not be parsed.",
+            )
+        self.truncated = True
+
 
 def _parse_text_bytes(data: bytes) -> str:
     return data.decode("utf-8", errors="ignore")
 
 
-def _parse_html_bytes(data: bytes) -> str:
-    soup = BeautifulSoup(data, "html.parser")
-    return soup.get_text(" ", strip=True)
+class _HTMLText(HTMLParser):
+    """Collects the stripped, non-empty text nodes of an HTML document as it is fed."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.strings: List[str] = []
+        self._node: List[str] = []
+        self._skip = 0
+
+    def _flush(self) -> None:
+        # The parser may hand one text node over in parts (e.g. at a block boundary).
+        text = "".join(self._node).strip()
+        self._node.clear()
+        if text:
+            self.strings.append(text)
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self._flush()
+        if tag in _HTML_SKIP_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        self._flush()
+        if tag in _HTML_SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_comment(self, data: str) -> None:
+        self._flush()
+
+    def handle_decl(self, decl: str) -> None:
+        self._flush()
+
+    def handle_pi(self, data: str) -> None:
+        self._flush()
 
+    def handle_data(self, data: str) -> None:
+        if not self._skip:
+            self._node.append(data)
 
-def _parse_pdf_bytes(data: bytes) -> str:
-    # Extract text from PDF; if none, likely scanned
-    reader = PdfReader(BytesIO(data))
-    texts: list[str] = []
-    for page in reader.pages:
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+
+def _html_encoding(head: bytes) -> str:
+    """Encoding of an HTML document judged from its first block (BOM, <meta charset>, UTF-8, Windows-1252)."""
+    for encoding in EncodingDetector(head, is_html=True).encodings:
         try:
-            page_text = page.extract_text() or ""
-        except Exception:
-            page_text = ""
-        if page_text:
-            texts.append(page_text)
-    text = "\n".join(t.strip() for t in texts if t.strip())
-    if not text.strip():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Scanned PDFs are not supported in MVP (no extractable text).",
-        )
-    return text
+            codecs.getincrementaldecoder(encoding)().decode(head)
+        except (LookupError, UnicodeDecodeError):
+            continue
+        # utf-8-sig also drops a byte order mark
+        return "utf-8-sig" if codecs.lookup(encoding).name == "utf-8" else encoding
+    return "utf-8-sig"
 
 
-def parse_from_bytes(filename: str, content_type: Optional[str], data: bytes) -> str:
-    """Parse text from bytes based on content type or filename.
+def _iter_html(source: BinaryIO, budget: ParseBudget) -> Iterator[str]:
+    """Text of an HTML document, parsed incrementally in HTML_BLOCK_BYTES blocks.
 
-    Supported: text, markdown, html, pdf. Raises HTTPException for unsupported types
-    or empty content.
+    Gives the same text as ``BeautifulSoup(...).get_text(" ", strip=True)``,
+    but checks the parse deadline between blocks and yields text as it is
+    found, so the character budget also stops parsing early.
     """
-    if not data:
+    parser = _HTMLText()
+    decoder: Optional[codecs.IncrementalDecoder] = None
+    first = True
+    while True:
+        if budget.expired():
+            budget.hit("time")
+            return
+        block = source.read(HTML_BLOCK_BYTES)
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(_html_encoding(block))(errors="replace")
+        parser.feed(decoder.decode(block, final=not block))
+        if not block:
+            parser.close()
+        if parser.strings:
+            text = " ".join(parser.strings)
+            parser.strings.clear()
+            yield text if first else " " + text
+            first = False
+        if not block:
+            return
+
+
+def _page_text(reader: PdfReader, index: int) -> str:
+    try:
+        return reader.pages[index].extract_text() or ""
+    except Exception:
+        return ""
+
+
+def _iter_reader_pages(reader: PdfReader, start: int, stop: int, budget: ParseBudget) -> Iterator[str]:
+    """Yield page texts for [start, stop) one at a time, checking the deadline between pages.
+
+    The character cap is left to ``_clipped``, which stops pulling pages once
+    it is reached.
+    """
+    for i in range(start, stop):
+        if budget.expired():
+            budget.hit("time")
+            return
+        yield _page_text(reader, i)
+
+
+def _extract_pages(
+    reader: PdfReader, start: int, stop: int, deadline: float = 0.0, max_chars: int = 0
+) -> Tuple[List[str], Optional[str]]:
+    """Extract pages [start, stop); stops early on the deadline or character cap.
+
+    Returns (page texts, name of the budget that stopped it or None). The
+    name is only given when pages of the range were left out.
+    """
+    texts: List[str] = []
+    chars = 0
+    for i in range(start, stop):
+        if deadline and time.time() >= deadline:
+            return texts, "time"
+        page_text = _page_text(reader, i)
+        texts.append(page_text)
+        chars += len(page_text)
+        if max_chars and chars > max_chars and i + 1 < stop:
+            return texts, "character"
+    return texts, None
+
+
+def _extract_page_range(
+    path: str, start: int, stop: int, deadline: float, max_chars: int
+) -> Tuple[List[str], Optional[str]]:
+    """Process-pool task: open the PDF in the worker and extract pages [start, stop)."""
+    return _extract_pages(PdfReader(path), start, stop, deadline, max_chars)
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_closed = False
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool_closed:
+            raise RuntimeError("The PDF parse pool is shut down.")
+        if _pdf_pool is None:
+            # forkserver: workers never inherit the event loop or provider threads
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=config.PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _pdf_pool
+
+
+def _retire_pool(pool: ProcessPoolExecutor) -> None:
+    """Kill ``pool``'s workers to free one stuck on a page; later submissions get a fresh pool.
+
+    ProcessPoolExecutor cannot interrupt a single task, and a dead worker
+    breaks the whole pool, so other documents' ranges on it fail with
+    BrokenProcessPool and are resubmitted by their own iterators. Nothing is
+    cancelled, so no caller sees a CancelledError from this.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False)
+
+
+def shutdown_parse_pool() -> None:
+    """Shut the PDF pool down at app exit; documents still parsing keep only the pages already extracted."""
+    global _pdf_pool, _pdf_pool_closed
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+        _pdf_pool_closed = True
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _pdf_page_count(reader: PdfReader, budget: ParseBudget) -> int:
+    num_pages = len(reader.pages)
+    if budget.max_pages and num_pages > budget.max_pages:
+        budget.hit("page")
+        return budget.max_pages
+    return num_pages
+
+
+def _iter_pdf_pages(source: Union[BinaryIO, Path], budget: ParseBudget) -> Iterator[str]:
+    reader = PdfReader(source)
+    yield from _iter_reader_pages(reader, 0, _pdf_page_count(reader, budget), budget)
+
+
+def _iter_pdf_pages_parallel(path: Path, budget: ParseBudget) -> Iterator[str]:
+    """Yield a PDF's page texts in order, splitting page ranges across the parse process pool.
+
+    Small documents (one PARSE_PAGES_PER_TASK range or less) and PARSE_WORKERS=1
+    are extracted page by page in the calling thread. Pool ranges are yielded
+    as soon as they and all earlier ranges are done; when a budget stops
+    extraction, only the in-order prefix of pages is produced.
+
+    At most two ranges per worker are queued at a time, each carrying the
+    deadline as it is when submitted, so ``ParseBudget.extend`` reaches later
+    ranges; a range a worker stopped on an outdated deadline is resubmitted
+    from the first page it skipped.
+    """
+    reader = PdfReader(path)
+    num_pages = _pdf_page_count(reader, budget)
+    step = config.PARSE_PAGES_PER_TASK
+    if config.PARSE_WORKERS <= 1 or num_pages <= step:
+        yield from _iter_reader_pages(reader, 0, num_pages, budget)
+        return
+    ranges = [(start, min(num_pages, start + step)) for start in range(0, num_pages, step)]
+    window = 2 * config.PARSE_WORKERS
+    pool: Optional[ProcessPoolExecutor] = None
+
+    def submit(start: int, stop: int) -> Future:
+        assert pool is not None
+        return pool.submit(_extract_page_range, str(path), start, stop, budget.deadline, budget.max_chars)
+
+    futures: List[Optional[Future]] = [None] * len(ranges)
+    resubmitted = False
+    try:
+        i = 0
+        while i < len(ranges):
+            try:
+                if pool is None:
+                    pool = _get_pdf_pool()
+                for j in range(i, min(len(ranges), i + window)):
+                    if futures[j] is None:
+                        futures[j] = submit(*ranges[j])
+                part, stopped = futures[i].result(timeout=budget.remaining())  # type: ignore[union-attr]
+            except FutureTimeout:
+                # A single page can exceed the deadline; free the worker it holds.
+                _retire_pool(pool)  # type: ignore[arg-type]
+                budget.hit("time")
+                return
+            except (BrokenProcessPool, CancelledError, RuntimeError) as exc:
+                # A worker died (another document's deadline retired the pool, or
+                # a page crashed it) or the app shut the pool down. Move the
+                # unfinished ranges to a fresh pool once; after that, give up on
+                # the rest rather than parse a crashing page in this process.
+                if isinstance(exc, BrokenProcessPool) and pool is not None:
+                    _retire_pool(pool)  # so the next submission gets a working pool
+                if resubmitted:
+                    budget.lost()
+                    return
+                resubmitted = True
+                pool = None
+                for j in range(i, len(ranges)):
+                    future = futures[j]
+                    if future is not None and not (
+                        future.done() and not future.cancelled() and future.exception() is None
+                    ):
+                        future.cancel()
+                        futures[j] = None
+                continue
+            yield from part
+            if stopped == "time" and not budget.expired():
+                # The deadline was extended after this range was submitted.
+                start, stop = ranges[i]
+                ranges[i] = (start + len(part), stop)
+                futures[i] = None
+                continue
+            if stopped:
+                budget.hit(stopped)
+                return
+            i += 1
+    finally:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+
+
+def _join_pdf_pages(pages: Iterable[str], budget: ParseBudget) -> Iterator[str]:
+    """Pieces of "\n".join(stripped non-empty pages); raises when nothing was extracted."""
+    first = True
+    for page in pages:
+        page = page.strip()
+        if not page:
+            continue
+        yield page if first else "\n" + page
+        first = False
+    if first and budget.truncated:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Empty file uploaded.",
+            detail="No text could be extracted within the parse budget.",
+        )
+    if first:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Scanned PDFs are not supported in MVP (no extractable text).",
         )
 
+
+def _kind(filename: str, content_type: Optional[str]) -> str:
     ctype = (content_type or "").lower()
     name = filename.lower()
-
-    text: str
     if ctype in TEXT_TYPES or name.endswith(".txt") or name.endswith(".md") or name.endswith(".markdown"):
-        text = _parse_text_bytes(data)
-    elif ctype in HTML_TYPES or name.endswith(".html") or name.endswith(".htm"):
-        text = _parse_html_bytes(data)
-    elif ctype in PDF_TYPES or name.endswith(".pdf"):
-        text = _parse_pdf_bytes(data)
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Unsupported file type. Please upload txt, md, html, or pdf.",
-        )
+        return "text"
+    if ctype in HTML_TYPES or name.endswith(".html") or name.endswith(".htm"):
+        return "html"
+    if ctype in PDF_TYPES or name.endswith(".pdf"):
+        return "pdf"
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Unsupported file type. Please upload txt, md, html, or pdf.",
+    )
 
-    if not text.strip():
+
+def _clipped(pieces: Iterable[str], budget: ParseBudget) -> Iterator[str]:
+    """Apply the character budget across pieces and reject documents with no text."""
+    chars = 0
+    has_text = False
+    source = iter(pieces)
+    try:
+        for piece in source:
+            if budget.max_chars and chars + len(piece) > budget.max_chars:
+                piece = piece[: budget.max_chars - chars]
+                budget.hit("character")
+                if piece:
+                    has_text = has_text or bool(piece.strip())
+                    yield piece
+                break
+            chars += len(piece)
+            has_text = has_text or bool(piece.strip())
+            yield piece
+    finally:
+        # Stop the source early (closes files, cancels pending PDF page tasks).
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+    if not has_text:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No extractable text found in the document.",
         )
-    return text
+
+
+class ParseStream:
+    """Document text as an iterator of pieces (e.g. PDF pages), parsed lazily.
+
+    Concatenated, the pieces equal ``parse_from_*(...).text``. ``truncated``
+    is final once the iterator is exhausted. Iterate in one thread: PDF
+    extraction and budget checks run as pieces are pulled.
+    """
+
+    def __init__(self, pieces: Iterable[str], budget: ParseBudget) -> None:
+        self._pieces = _clipped(pieces, budget)
+        self._budget = budget
+
+    @property
+    def truncated(self) -> bool:
+        return self._budget.truncated
+
+    def extend_deadline(self, seconds: float) -> None:
+        """Do not count time the consumer spent not pulling pieces against the parse deadline."""
+        self._budget.extend(seconds)
+
+    def give_up(self) -> None:
+        """Keep only the pieces pulled so far, e.g. when parsing stalls past the deadline.
+
+        Raises the time-budget error (400) in "fail" mode, otherwise marks the
+        stream truncated. Safe to call from a thread other than the one iterating.
+        """
+        self._budget.hit("time")
+
+    def __iter__(self) -> Iterator[str]:
+        return self._pieces
+
+
+def _empty_file() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Empty file uploaded.",
+    )
+
+
+def _read_blocks(path: Path) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as fh:
+        while True:
+            block = fh.read(TEXT_BLOCK_CHARS)
+            if not block:
+                return
+            yield block
+
+
+def _read_html(path: Path, budget: ParseBudget) -> Iterator[str]:
+    with open(path, "rb") as fh:
+        yield from _iter_html(fh, budget)
+
+
+def stream_from_bytes(filename: str, content_type: Optional[str], data: bytes) -> ParseStream:
+    """Streaming form of ``parse_from_bytes``; type and emptiness are checked up front."""
+    if not data:
+        raise _empty_file()
+
+    budget = ParseBudget()
+    kind = _kind(filename, content_type)
+    if kind == "text":
+        pieces: Iterable[str] = [_parse_text_bytes(data)]
+    elif kind == "html":
+        pieces = _iter_html(BytesIO(data), budget)
+    else:
+        pieces = _join_pdf_pages(_iter_pdf_pages(BytesIO(data), budget), budget)
+    return ParseStream(pieces, budget)
+
+
+def stream_from_path(filename: str, content_type: Optional[str], path: Path) -> ParseStream:
+    """Streaming form of ``parse_from_path``.
+
+    Plain text is read in blocks and PDF pages are produced as they are
+    extracted (in parallel for long PDFs), so downstream chunking and
+    embedding can start before the whole document is parsed.
+    """
+    if path.stat().st_size == 0:
+        raise _empty_file()
+
+    budget = ParseBudget()
+    kind = _kind(filename, content_type)
+    if kind == "text":
+        pieces: Iterable[str] = _read_blocks(path)
+    elif kind == "html":
+        pieces = _read_html(path, budget)
+    else:
+        pieces = _join_pdf_pages(_iter_pdf_pages_parallel(path, budget), budget)
+    return ParseStream(pieces, budget)
+
+
+def _collect(stream: ParseStream) -> ParseResult:
+    text = "".join(stream)
+    return ParseResult(text=text, truncated=stream.truncated)
+
+
+def parse_from_bytes(filename: str, content_type: Optional[str], data: bytes) -> ParseResult:
+    """Parse text from bytes based on content type or filename.
+
+    Supported: text, markdown, html, pdf. Raises HTTPException for unsupported types
+    or empty content. Parse budgets apply (see ``ParseBudget``).
+    """
+    return _collect(stream_from_bytes(filename, content_type, data))
+
+
+def parse_from_path(filename: str, content_type: Optional[str], path: Path) -> ParseResult:
+    """Parse text from a file on disk; same rules as ``parse_from_bytes``.
+
+    The file is read through a stream rather than loaded whole: pypdf reads
+    only the objects it needs and html.parser is fed from the open file.
+    """
+    return _collect(stream_from_path(filename, content_type, path))
@@ -1,21 +1,188 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
 import time
 import uuid
-from typing import Dict, List, Optional
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
 from fastapi import HTTPException, status
 
 from app import config
-from app.lib.chunker import chunk_text
-from app.lib.embeddings import embed_texts
-from app.lib.parsers import parse_from_bytes
+from app.lib.answer_cache import answer_cache
+from app.lib.chunker import iter_chunks
+from app.lib.embeddings import embed_texts_async
+from app.lib.jobs import worker_gone, worker_id
+from app.lib.logger import get_logger
+from app.lib.parsers import ParseStream, stream_from_bytes, stream_from_path
 from app.store.vector_store import VectorStore
 from app.lib.db import SessionLocal
-from app.store.models import Document
+from app.store.models import Chat, Document
+from sqlalchemy import delete, select, update
 
 
 vec_store = VectorStore(config.VEC_PATH)
+logger = get_logger("rag.ingest")
+
+# Pending documents whose worker cannot be checked (another host) are failed once untouched this long
+STALE_PENDING_SECONDS = 24 * 3600
+
+# progress(stage, done, total), e.g. IngestJob.progress
+ProgressFn = Callable[[str, int, int], None]
+# embed(texts) -> vectors, e.g. embed_texts_async or EmbedBatcher.embed
+EmbedFn = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+def _no_progress(stage: str, done: int = 0, total: int = 0) -> None:
+    return None
+
+
+class _Stopped(Exception):
+    """Raised in the producer thread once the consumer has given up."""
+
+
+@dataclass
+class _PipelineStats:
+    started: float
+    chunks: int = 0
+    upserted: int = 0
+    parse_done: Optional[float] = None
+    first_upsert: Optional[float] = None
+
+    def timings(self) -> Dict[str, float]:
+        def ms(at: Optional[float]) -> float:
+            return round(((at or self.started) - self.started) * 1000.0, 1)
+
+        return {
+            "parseMs": ms(self.parse_done),
+            "firstChunkMs": ms(self.first_upsert),
+            "totalMs": ms(time.perf_counter()),
+        }
+
+
+async def _run_pipeline(
+    stream: ParseStream,
+    document_id: str,
+    chat_id: str,
+    created_at: int,
+    report: ProgressFn,
+    embed: EmbedFn = embed_texts_async,
+) -> _PipelineStats:
+    """Parse → chunk → embed → upsert with bounded queues between stages.
+
+    A worker thread pulls text from ``stream``, chunks it with ``iter_chunks``
+    and hands EMBED_BATCH_SIZE-chunk batches to the loop through a queue of
+    INGEST_PIPELINE_DEPTH batches. Up to EMBED_CONCURRENCY batches are
+    embedded at once; each is upserted, in order, as soon as it is ready.
+    A full queue blocks the parser, and that wait is not charged to the parse
+    deadline. A parser that sends nothing for longer than the deadline is
+    abandoned: the document fails in "fail" mode, otherwise it keeps the
+    chunks already queued and is marked truncated.
+    """
+    loop = asyncio.get_running_loop()
+    batches: "asyncio.Queue[object]" = asyncio.Queue(maxsize=config.INGEST_PIPELINE_DEPTH)
+    stop = threading.Event()
+    stats = _PipelineStats(started=time.perf_counter())
+
+    def put(item: object) -> None:
+        if stop.is_set():
+            raise _Stopped()
+        future = asyncio.run_coroutine_threadsafe(batches.put(item), loop)
+        waited = time.perf_counter()
+        while True:
+            try:
+                future.result(timeout=0.5)
+                break
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    raise _Stopped()
+        stream.extend_deadline(time.perf_counter() - waited)
+
+    def produce() -> None:
+        try:
+            batch: List[str] = []
+            for chunk in iter_chunks(stream):
+                batch.append(chunk)
+                if len(batch) >= config.EMBED_BATCH_SIZE:
+                    put(batch)
+                    batch = []
+            if batch:
+                put(batch)
+            stats.parse_done = time.perf_counter()
+            put(None)
+        except _Stopped:
+            return
+        except BaseException as exc:
+            try:
+                put(exc)
+            except _Stopped:
+                return
+
+    async def flush(item: Tuple[int, List[str], "asyncio.Task[List[List[float]]]"], stage: str) -> None:
+        first_index, texts, task = item
+        embeddings = await task
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "documentId": document_id,
+                "chunkId": first_index + offset,
+                "text": text,
+                "embedding": embedding,
+                "createdAt": created_at,
+                "chatId": chat_id,
+            }
+            for offset, (text, embedding) in enumerate(zip(texts, embeddings))
+        ]
+        stats.upserted += await vec_store.upsert(rows)
+        if stats.first_upsert is None:
+            stats.first_upsert = time.perf_counter()
+        report(stage, stats.upserted, stats.chunks)
+
+    producer = loop.run_in_executor(None, produce)
+    inflight: Deque[Tuple[int, List[str], "asyncio.Task[List[List[float]]]"]] = deque()
+    # Backstop for a single parse call (e.g. one huge HTML file) that never yields.
+    idle_limit = config.PARSE_DEADLINE_SECONDS + 5.0 if config.PARSE_DEADLINE_SECONDS > 0 else None
+    report("parse", 0, 0)
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(batches.get(), idle_limit)
+            except asyncio.TimeoutError:
+                stream.give_up()
+                # The parser thread cannot be interrupted; it stops at its next batch.
+                stop.set()
+                stats.parse_done = time.perf_counter()
+                break
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            texts: List[str] = item  # type: ignore[assignment]
+            inflight.append((stats.chunks, texts, asyncio.create_task(embed(texts))))
+            stats.chunks += len(texts)
+            report("embed", stats.upserted, stats.chunks)
+            while inflight and (len(inflight) >= config.EMBED_CONCURRENCY or inflight[0][2].done()):
+                await flush(inflight.popleft(), "embed")
+        # Parsing is done; only the last embeddings and upserts remain.
+        report("upsert", stats.upserted, stats.chunks)
+        while inflight:
+            await flush(inflight.popleft(), "upsert")
+    except BaseException:
+        stop.set()
+        for _, _, task in inflight:
+            task.cancel()
+        raise
+    if not stop.is_set():
+        await producer
+    if not stats.chunks:
+        raise HTTPException(status_code=400, detail="No text to index.")
+    return stats
 
 
 def generate_document_id() -> str:
@@ -26,57 +193,120 @@ def generate_document_id() -> str:
 async def ingest_document(
     *,
     filename: str,
-    data: bytes,
     chat_id: str,
     uploader_user_id: str,
+    data: Optional[bytes] = None,
+    path: Optional[Path] = None,
     document_id: Optional[str] = None,
     size_bytes: Optional[int] = None,
+    content_type: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    progress: Optional[ProgressFn] = None,
+    pending: bool = False,
+    embed: EmbedFn = embed_texts_async,
 ) -> Dict[str, object]:
     """Parse → chunk → embed → upsert chunks; create Document if DB is enabled.
 
-    Returns: { ok, documentId, chunks }
+    The stages run as a pipeline (see ``_run_pipeline``), so chunks become
+    searchable batch by batch while later pages are still being parsed.
+
+    The source is either in-memory ``data`` or a spooled file at ``path``
+    (parsed from disk; the caller removes it). With ``pending`` the Document
+    was already created by ``create_pending_document`` and is marked indexed
+    instead; if it was deleted meanwhile the new chunks are dropped (409).
+
+    The SHA-256 of the raw bytes (``content_hash``, computed here when not
+    given) is stored on the Document. If the chat already has an indexed
+    document with the same hash, nothing is parsed or embedded, a pending
+    Document is removed, and the existing document is returned with
+    ``duplicate: true``.
+    ``embed`` replaces the embedding call, e.g. with a shared ``EmbedBatcher``.
+    Returns: { ok, documentId, chunks, truncated, timings } or
+    { ok, documentId, chunks, duplicate: true }
     """
+    report = progress or _no_progress
+
+    if (data is None) == (path is None):
+        raise ValueError("ingest_document needs exactly one of data or path")
 
     # Validate size limit
-    actual_size = size_bytes if size_bytes is not None else len(data)
+    if size_bytes is not None:
+        actual_size = size_bytes
+    elif path is not None:
+        actual_size = path.stat().st_size
+    else:
+        actual_size = len(data or b"")
     if actual_size > config.MAX_UPLOAD_BYTES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"File too large. Max {config.MAX_UPLOAD_MB}MB.",
         )
 
-    # Parse
-    text = parse_from_bytes(filename=filename, content_type=None, data=data)
-
-    # Chunk
-    chunks = chunk_text(text)
-    if not chunks:
-        raise HTTPException(status_code=400, detail="No text to index.")
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(_sha256, data, path)
+    duplicate = await find_duplicate(chat_id, content_hash)
+    if duplicate is not None and str(duplicate.id) != document_id:
+        if pending and document_id:
+            await discard_document(document_id, chat_id=chat_id)
+        logger.info("skipped %s: same content as document %s", filename, duplicate.id)
+        return duplicate_result(duplicate)
 
-    # Embed
-    embeddings = embed_texts(chunks)
+    # Type and emptiness are checked here; the text itself is parsed lazily
+    # by the pipeline's producer thread.
+    if path is not None:
+        stream = stream_from_path(filename, content_type, path)
+    else:
+        stream = stream_from_bytes(filename, content_type, data or b"")
 
-    # Upsert into vector store
     created_at = int(time.time())
     assigned_document_id = document_id or generate_document_id()
-    rows: List[dict] = []
-    for idx, (chunk_text_value, embedding) in enumerate(zip(chunks, embeddings)):
-        row = {
-            "id": str(uuid.uuid4()),
-            "documentId": assigned_document_id,
-            "chunkId": idx,
-            "text": chunk_text_value,
-            "embedding": embedding,
-            "createdAt": created_at,
-            "chatId": chat_id,
-        }
-        rows.append(row)
-
-    upserted = await vec_store.upsert(rows)
+    try:
+        stats = await _run_pipeline(stream, assigned_document_id, chat_id, created_at, report, embed)
+    except BaseException:
+        # Earlier batches may already be committed.
+        await vec_store.delete_by_document_id(assigned_document_id, chat_id=chat_id)
+        raise
+    finally:
+        # Cached answers may predate (or have seen part of) this document.
+        answer_cache.invalidate(chat_id)
+    truncated = stream.truncated
+    upserted = stats.upserted
+    num_chunks = stats.chunks
+    timings = stats.timings()
+    logger.info(
+        "ingested %s: %d chunks, parse %.1fms, first chunk %.1fms, total %.1fms%s",
+        filename,
+        num_chunks,
+        timings["parseMs"],
+        timings["firstChunkMs"],
+        timings["totalMs"],
+        " (truncated)" if truncated else "",
+    )
 
     # Persist Document in DB when available
     if SessionLocal:
         async with SessionLocal() as session:  # type: ignore[arg-type]
+            if pending:
+                doc = await session.get(Document, uuid.UUID(assigned_document_id))
+                if doc is None:
+                    await vec_store.delete_by_document_id(assigned_document_id, chat_id=chat_id)
+                    raise HTTPException(status_code=409, detail="Document was deleted during ingestion.")
+                doc.size_bytes = actual_size
+                doc.num_chunks = num_chunks
+                doc.indexed = True
+                doc.truncated = truncated
+                doc.content_hash = content_hash
+                doc.ingest_owner = None
+                doc.ingest_error = None
+                doc.updated_at = created_at
+                await session.commit()
+                return {
+                    "ok": True,
+                    "documentId": assigned_document_id,
+                    "chunks": upserted,
+                    "truncated": truncated,
+                    "timings": timings,
+                }
             doc = Document(
                 id=uuid.UUID(assigned_document_id),
                 chat_id=uuid.UUID(chat_id),
@@ -85,12 +315,330 @@ async def ingest_document(
                 mime_type=None,
                 size_bytes=actual_size,
                 storage_key=None,
-                num_chunks=len(rows),
+                num_chunks=num_chunks,
                 indexed=True,
+                truncated=truncated,
+                content_hash=content_hash,
                 created_at=created_at,
                 updated_at=created_at,
             )
             session.add(doc)
             await session.commit()
 
-    return {"ok": True, "documentId": assigned_document_id, "chunks": upserted}
+    return {
+        "ok": True,
+        "documentId": assigned_document_id,
+        "chunks": upserted,
+        "truncated": truncated,
+        "timings": timings,
+    }
+
+
+# Documents with an update running in this process; a second update is refused.
+_updating: Set[str] = set()
+
+
+@dataclass
+class _ChunkDiff:
+    rows: List[Dict[str, object]]  # every chunk of the new version, in order
+    fresh: List[int]  # indexes into rows that still need an embedding
+    unchanged_ids: Set[str]  # stored chunks left exactly as they are
+    stale_ids: List[str]  # stored chunks the new version no longer has
+
+
+def _diff_chunks(
+    chunks: List[str], stored: List[Dict[str, object]], *, document_id: str, chat_id: str, created_at: int
+) -> _ChunkDiff:
+    """Match new chunk texts to stored chunks by text hash.
+
+    A match keeps the stored id and embedding (and is unchanged when it also
+    kept its position); anything unmatched becomes a new row to embed, and
+    stored chunks left over are stale.
+    """
+    pool: Dict[bytes, Deque[Dict[str, object]]] = {}
+    for row in stored:
+        key = hashlib.sha256(str(row["text"]).encode("utf-8")).digest()
+        pool.setdefault(key, deque()).append(row)
+    diff = _ChunkDiff(rows=[], fresh=[], unchanged_ids=set(), stale_ids=[])
+    for index, text in enumerate(chunks):
+        matches = pool.get(hashlib.sha256(text.encode("utf-8")).digest())
+        if matches:
+            old = matches.popleft()
+            if int(old["chunkId"]) == index:  # type: ignore[arg-type]
+                diff.unchanged_ids.add(str(old["id"]))
+            diff.rows.append({**old, "chunkId": index})
+            continue
+        diff.fresh.append(index)
+        diff.rows.append(
+            {
+                "id": str(uuid.uuid4()),
+                "documentId": document_id,
+                "chunkId": index,
+                "text": text,
+                "embedding": [],
+                "createdAt": created_at,
+                "chatId": chat_id,
+            }
+        )
+    diff.stale_ids = [str(row["id"]) for rows in pool.values() for row in rows]
+    return diff
+
+
+async def get_owned_document(document_id: str, user_id: str) -> Document:
+    """Load a Document whose chat belongs to ``user_id``; 404 otherwise."""
+    if not SessionLocal:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    try:
+        doc_uuid = uuid.UUID(document_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid documentId")
+    async with SessionLocal() as session:  # type: ignore[arg-type]
+        doc = await session.get(Document, doc_uuid)
+        chat = await session.get(Chat, doc.chat_id) if doc else None
+    if not doc or not chat or str(chat.user_id) != user_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
+
+
+async def update_document(
+    *,
+    document_id: str,
+    user_id: str,
+    filename: str,
+    path: Path,
+    size_bytes: int,
+    content_hash: str,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, object]:
+    """Replace a document with a new version, embedding only chunks that changed.
+
+    The new version is parsed and chunked in full, then diffed against the
+    stored chunks (see ``_diff_chunks``). Only unmatched chunks are embedded,
+    and nothing is written until every embedding is in, so a provider error
+    leaves the old version intact. Identical bytes are a no-op.
+    Returns: { ok, documentId, chunks, embedded, reused, removed, truncated, timings }
+    """
+    report = progress or _no_progress
+    if document_id in _updating:
+        raise HTTPException(status_code=409, detail="Document is already being updated.")
+    _updating.add(document_id)
+    try:
+        doc = await get_owned_document(document_id, user_id)
+        if not doc.indexed and doc.ingest_error is None:
+            raise HTTPException(status_code=409, detail="Document is still being ingested.")
+        chat_id = str(doc.chat_id)
+        if doc.indexed and doc.content_hash == content_hash:
+            return {"ok": True, "documentId": document_id, "chunks": int(doc.num_chunks), "unchanged": True}
+
+        started = time.perf_counter()
+        report("parse", 0, 0)
+        stream = stream_from_path(filename, None, path)
+        chunks = await asyncio.to_thread(lambda: list(iter_chunks(stream)))
+        if not chunks:
+            raise HTTPException(status_code=400, detail="No text to index.")
+        parse_ms = round((time.perf_counter() - started) * 1000.0, 1)
+
+        now = int(time.time())
+        stored = await vec_store.document_chunks(document_id, chat_id=chat_id)
+        diff = _diff_chunks(chunks, stored, document_id=document_id, chat_id=chat_id, created_at=now)
+
+        # Same request sizes as the ingest pipeline, so progress moves per round.
+        step = max(1, config.EMBED_BATCH_SIZE * config.EMBED_CONCURRENCY)
+        report("embed", 0, len(diff.fresh))
+        for start in range(0, len(diff.fresh), step):
+            indexes = diff.fresh[start : start + step]
+            embeddings = await embed_texts_async([str(diff.rows[i]["text"]) for i in indexes])
+            for i, embedding in zip(indexes, embeddings):
+                diff.rows[i]["embedding"] = embedding
+            report("embed", start + len(indexes), len(diff.fresh))
+
+        report("upsert", 0, len(diff.rows))
+        try:
+            await vec_store.replace_document(
+                document_id,
+                diff.rows,
+                chat_id=chat_id,
+                unchanged_ids=diff.unchanged_ids,
+                stale_ids=diff.stale_ids,
+            )
+        finally:
+            answer_cache.invalidate(chat_id)
+        async with SessionLocal() as session:  # type: ignore[arg-type]
+            current = await session.get(Document, uuid.UUID(document_id))
+            if current is None:
+                await vec_store.delete_by_document_id(document_id, chat_id=chat_id)
+                raise HTTPException(status_code=409, detail="Document was deleted during the update.")
+            current.filename = filename
+            current.size_bytes = size_bytes
+            current.num_chunks = len(diff.rows)
+            current.truncated = stream.truncated
+            current.content_hash = content_hash
+            current.indexed = True
+            current.ingest_error = None
+            current.updated_at = now
+            await session.commit()
+    finally:
+        _updating.discard(document_id)
+
+    reused = len(diff.rows) - len(diff.fresh)
+    total_ms = round((time.perf_counter() - started) * 1000.0, 1)
+    logger.info(
+        "updated %s: %d chunks, %d embedded, %d reused, %d removed, total %.1fms",
+        filename,
+        len(diff.rows),
+        len(diff.fresh),
+        reused,
+        len(diff.stale_ids),
+        total_ms,
+    )
+    return {
+        "ok": True,
+        "documentId": document_id,
+        "chunks": len(diff.rows),
+        "embedded": len(diff.fresh),
+        "reused": reused,
+        "removed": len(diff.stale_ids),
+        "truncated": stream.truncated,
+        "timings": {"parseMs": parse_ms, "totalMs": total_ms},
+    }
+
+
+def _sha256(data: Optional[bytes], path: Optional[Path]) -> str:
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+        return digest.hexdigest()
+    with open(path, "rb") as fh:  # type: ignore[arg-type]
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def find_duplicate(chat_id: str, content_hash: Optional[str]) -> Optional[Document]:
+    """Return an indexed Document in the chat with the same content hash, if any."""
+    if not SessionLocal or not content_hash:
+        return None
+    async with SessionLocal() as session:  # type: ignore[arg-type]
+        stmt = (
+            select(Document)
+            .where(
+                Document.chat_id == uuid.UUID(chat_id),
+                Document.content_hash == content_hash,
+                Document.indexed.is_(True),
+            )
+            .order_by(Document.created_at)
+            .limit(1)
+        )
+        res = await session.execute(stmt)
+        return res.scalars().first()
+
+
+def duplicate_result(doc: Document) -> Dict[str, object]:
+    return {"ok": True, "documentId": str(doc.id), "chunks": int(doc.num_chunks), "duplicate": True}
+
+
+async def create_pending_document(
+    *,
+    document_id: str,
+    chat_id: str,
+    uploader_user_id: str,
+    filename: str,
+    size_bytes: int,
+    content_hash: Optional[str] = None,
+) -> None:
+    """Insert the Document with indexed=False so listings show queued/in-flight uploads."""
+    await create_pending_documents(
+        [(document_id, filename, size_bytes, content_hash)],
+        chat_id=chat_id,
+        uploader_user_id=uploader_user_id,
+    )
+
+
+async def create_pending_documents(
+    documents: Iterable[Tuple[str, str, int, Optional[str]]], *, chat_id: str, uploader_user_id: str
+) -> None:
+    """Insert pending Documents, given as (document_id, filename, size_bytes, content_hash), in one commit."""
+    if not SessionLocal:
+        return
+    now = int(time.time())
+    owner = worker_id()
+    async with SessionLocal() as session:  # type: ignore[arg-type]
+        for document_id, filename, size_bytes, content_hash in documents:
+            session.add(
+                Document(
+                    id=uuid.UUID(document_id),
+                    chat_id=uuid.UUID(chat_id),
+                    uploader_user_id=uuid.UUID(uploader_user_id),
+                    filename=filename,
+                    mime_type=None,
+                    size_bytes=size_bytes,
+                    storage_key=None,
+                    num_chunks=0,
+                    indexed=False,
+                    truncated=False,
+                    content_hash=content_hash,
+                    ingest_owner=owner,
+                    created_at=now,
+                    updated_at=now,
+                )
+            )
+        await session.commit()
+
+
+async def discard_document(document_id: str, *, chat_id: str) -> None:
+    """Remove a failed ingestion's chunks and pending Document."""
+    await vec_store.delete_by_document_id(document_id, chat_id=chat_id)
+    if SessionLocal:
+        async with SessionLocal() as session:  # type: ignore[arg-type]
+            await session.execute(delete(Document).where(Document.id == uuid.UUID(document_id)))
+            await session.commit()
+
+
+async def fail_interrupted_documents() -> int:
+    """Mark pending Documents whose ingestion died with its worker as failed.
+
+    Jobs live in memory, so a crash or restart leaves their Documents pending
+    for good. Called at startup: documents owned by this process's
+    predecessor or by a dead worker on this host are failed right away,
+    those of other hosts (or from before owners were recorded) once untouched
+    for STALE_PENDING_SECONDS. Their chunks are removed and ``ingest_error``
+    set; uploading a new version (PUT) indexes them again.
+    Returns the number of documents failed.
+    """
+    if not SessionLocal:
+        return 0
+    now = int(time.time())
+    async with SessionLocal() as session:  # type: ignore[arg-type]
+        res = await session.execute(
+            select(Document.id, Document.chat_id, Document.ingest_owner, Document.updated_at).where(
+                Document.indexed.is_(False), Document.ingest_error.is_(None)
+            )
+        )
+        orphans = []
+        for document_id, chat_id, owner, updated_at in res.all():
+            gone = worker_gone(owner) if owner else None
+            if gone is None:
+                gone = int(updated_at) < now - STALE_PENDING_SECONDS
+            if gone:
+                orphans.append((str(document_id), str(chat_id)))
+    for document_id, chat_id in orphans:
+        await vec_store.delete_by_document_id(document_id, chat_id=chat_id)
+        answer_cache.invalidate(chat_id)
+    if orphans:
+        async with SessionLocal() as session:  # type: ignore[arg-type]
+            await session.execute(
+                update(Document)
+                .where(
+                    Document.id.in_([uuid.UUID(document_id) for document_id, _ in orphans]),
+                    Document.indexed.is_(False),
+                )
+                .values(
+                    ingest_error="Ingestion was interrupted by a server restart.",
+                    ingest_owner=None,
+                    num_chunks=0,
+                    updated_at=now,
+                )
+            )
+            await session.commit()
+        logger.warning("failed %d pending documents left by interrupted ingestion", len(orphans))
+    return len(orphans)
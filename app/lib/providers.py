@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Iterator, List, Optional
+
+import google.generativeai as genai
+import numpy as np
+from fastapi import HTTPException, status
+
+from app import config
+
+
+class Provider(ABC):
+    """Embedding and generation backend used by the ingest and ask paths.
+
+    Implementations are synchronous; async callers go through
+    ``app.lib.blocking.run_provider_call``.
+    """
+
+    name = "base"
+    # Identifies the vector space; embedding cache keys include it.
+    embedding_model = ""
+
+    @abstractmethod
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of non-empty texts, one vector per text, in order."""
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Return the model's answer for ``prompt``."""
+
+    @abstractmethod
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        """Yield the answer in pieces as they are produced."""
+
+
+class GoogleProvider(Provider):
+    """Google Generative AI (Gemini) embeddings and generation."""
+
+    name = "google"
+    embedding_model = config.EMBEDDING_MODEL
+
+    def _configure(self) -> None:
+        if not config.GOOGLE_API_KEY:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Missing GOOGLE_API_KEY. Please set it in the environment.",
+            )
+        genai.configure(api_key=config.GOOGLE_API_KEY)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self._configure()
+        try:
+            res = genai.embed_content(model=config.EMBEDDING_MODEL, content=texts)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Embedding service error.")
+        vecs = res.get("embedding")
+        if not isinstance(vecs, list) or len(vecs) != len(texts) or not all(vecs):
+            raise HTTPException(status_code=500, detail="Failed to embed content.")
+        return vecs  # type: ignore[return-value]
+
+    def generate(self, prompt: str) -> str:
+        self._configure()
+        try:
+            model = genai.GenerativeModel(config.GENERATION_MODEL)
+            resp = model.generate_content(prompt)
+            answer = resp.text.strip() if getattr(resp, "text", None) else ""
+        except Exception:
+            raise HTTPException(status_code=502, detail="Failed to generate an answer.")
+        if not answer:
+            raise HTTPException(status_code=502, detail="Model returned empty response.")
+        return answer
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        self._configure()
+        emitted = False
+        try:
+            model = genai.GenerativeModel(config.GENERATION_MODEL)
+            for chunk in model.generate_content(prompt, stream=True):
+                piece = getattr(chunk, "text", None) or ""
+                if piece:
+                    emitted = True
+                    yield piece
+        except Exception:
+            raise HTTPException(status_code=502, detail="Failed to generate an answer.")
+        if not emitted:
+            raise HTTPException(status_code=502, detail="Model returned empty response.")
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class LocalProvider(Provider):
+    """Deterministic offline provider for benchmarks and load tests.
+
+    Embeddings use the hashing trick: each lower-cased word and word bigram is
+    hashed to a signed coordinate, and the result is L2-normalized, so texts
+    sharing vocabulary score as similar. Answers are templated from the
+    prompt. ``latency_ms`` adds a fixed sleep per call to mimic a remote API.
+    """
+
+    name = "local"
+
+    def __init__(self, dim: int = config.EMBEDDING_DIM, latency_ms: float = config.LOCAL_PROVIDER_LATENCY_MS) -> None:
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.embedding_model = f"local/hashing-{dim}"
+
+    def _sleep(self) -> None:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _embed_one(self, text: str) -> List[float]:
+        tokens = _TOKEN_RE.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            # No word characters: fall back to a fixed unit vector so the row stays valid.
+            vec[0] = 1.0
+            norm = 1.0
+        return (vec / norm).tolist()
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self._sleep()
+        return [self._embed_one(t) for t in texts]
+
+    def generate(self, prompt: str) -> str:
+        self._sleep()
+        question = prompt.split("Question:", 1)[-1].split("\n", 1)[0].strip()
+        context = prompt.split("Context:\n", 1)[-1] if "Context:\n" in prompt else ""
+        excerpt = " ".join(context.split()[:60])
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"[local {digest}] {question}\n\n{excerpt}".strip()
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        # One word (with its trailing whitespace) per piece.
+        yield from re.findall(r"\S+\s*", self.generate(prompt))
+
+
+_provider: Optional[Provider] = None
+
+
+def get_provider() -> Provider:
+    """Return the process-wide provider selected by PROVIDER ("google" or "local")."""
+    global _provider
+    if _provider is None:
+        _provider = LocalProvider() if config.PROVIDER == "local" else GoogleProvider()
+    return _provider
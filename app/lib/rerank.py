@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app import config
+from app.lib.vectors import l2_normalize
+
+
+Row = Dict[str, object]
+
+
+def mmr_rerank(
+    query_vec: List[float],
+    candidates: List[Tuple[Row, float]],
+    *,
+    k: int,
+    lambda_: Optional[float] = None,
+) -> List[Tuple[Row, float]]:
+    """Pick ``k`` of ``candidates`` by Maximal Marginal Relevance.
+
+    Each step takes the candidate maximizing
+    ``lambda * sim(query, c) - (1 - lambda) * max sim(c, already picked)``,
+    so near-duplicates of earlier picks lose to slightly less relevant but
+    different chunks. All pairwise similarities come from one matrix product
+    over the candidates' "embedding" vectors; rows keep their original score.
+    Candidates without a usable embedding are left to plain ranking.
+    """
+    lam = config.MMR_LAMBDA if lambda_ is None else lambda_
+    dim = len(query_vec)
+    usable = [
+        i for i, (row, _) in enumerate(candidates) if np.shape(row.get("embedding", ())) == (dim,)  # type: ignore[arg-type]
+    ]
+    if k <= 0 or len(usable) < 2:
+        return candidates[: max(0, k)]
+
+    emb = l2_normalize(np.stack([np.asarray(candidates[i][0]["embedding"], dtype=np.float32) for i in usable]))
+    relevance = emb @ l2_normalize(np.asarray(query_vec, dtype=np.float32))
+    pairwise = emb @ emb.T
+
+    n = len(usable)
+    picked: List[int] = []
+    # Highest similarity of each candidate to anything picked so far.
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        scores = lam * relevance - (1.0 - lam) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best]) if len(picked) > 1 else pairwise[best].copy()
+    out = [candidates[usable[i]] for i in picked]
+    if len(out) < k:
+        rest = set(usable)
+        out.extend(c for i, c in enumerate(candidates) if i not in rest)
+    return out[:k]
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app import config
+from app.lib.jobs import worker_gone, worker_id
+
+
+# Bytes held in memory per upload while copying to the spool file
+BLOCK_BYTES = 1024 * 1024
+# Room for multipart boundaries, part headers and small fields on top of the file itself
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Spool entries no live worker on this host owns are removed once idle this long
+STALE_SPOOL_SECONDS = 24 * 3600
+
+
+def _too_large(max_bytes: Optional[int] = None) -> HTTPException:
+    limit_mb = config.MAX_UPLOAD_MB if max_bytes is None else max_bytes // (1024 * 1024)
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"File too large. Max {limit_mb}MB.",
+    )
+
+
+@dataclass
+class Spooled:
+    path: Path
+    size_bytes: int
+    # SHA-256 hex digest of the raw bytes, used for per-chat deduplication
+    content_hash: str
+    content_type: Optional[str] = None
+    # Client-supplied name, for uploads read with ``spool_form_file``
+    filename: Optional[str] = None
+
+
+def spool_dir() -> Path:
+    """This process's own directory under SPOOL_DIR, so workers never clear each other's files."""
+    path = config.SPOOL_DIR / worker_id()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _write_block(out: BinaryIO, digest: "hashlib._Hash", block: bytes) -> None:
+    digest.update(block)
+    out.write(block)
+
+
+async def spool_blocks(
+    blocks: AsyncIterator[bytes], suffix: str = "", max_bytes: Optional[int] = None
+) -> Spooled:
+    """Write an async stream of byte blocks to a new file in this process's spool directory.
+
+    ``max_bytes`` (default MAX_UPLOAD_BYTES) is enforced as blocks arrive, so an oversized stream is
+    rejected (and its partial file removed) without being read to the end.
+    The content hash is computed on the way through. The caller owns the file.
+    """
+    fd, name = tempfile.mkstemp(dir=spool_dir(), suffix=suffix)
+    path = Path(name)
+    limit = config.MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            async for block in blocks:
+                size += len(block)
+                if size > limit:
+                    raise _too_large(max_bytes)
+                await asyncio.to_thread(_write_block, out, digest, block)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return Spooled(path=path, size_bytes=size, content_hash=digest.hexdigest())
+
+
+def check_content_length(request: Request, max_bytes: Optional[int] = None) -> None:
+    """Reject a request whose declared body is already over the cap, before reading any of it."""
+    limit = config.MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit + FORM_OVERHEAD_BYTES:
+        raise _too_large(max_bytes)
+
+
+async def _form_events(request: Request, boundary: bytes) -> AsyncIterator[Tuple[str, bytes]]:
+    """Parser callbacks for a streamed multipart body as (event, data) pairs, in order."""
+    pending: Deque[Tuple[str, bytes]] = deque()
+
+    def on(event: str) -> Callable[..., None]:
+        def callback(data: bytes = b"", start: int = 0, end: int = 0) -> None:
+            pending.append((event, data[start:end]))
+
+        return callback
+
+    parser = MultipartParser(
+        boundary,
+        callbacks={
+            "on_part_begin": on("begin"),
+            "on_part_data": on("data"),
+            "on_part_end": on("end"),
+            "on_header_field": on("field"),
+            "on_header_value": on("value"),
+            "on_header_end": on("header"),
+            "on_headers_finished": on("headers"),
+        },
+    )
+    async for chunk in request.stream():
+        parser.write(chunk)
+        while pending:
+            yield pending.popleft()
+    parser.finalize()
+    while pending:
+        yield pending.popleft()
+
+
+@dataclass
+class FormFile:
+    """A file part of a streamed multipart body; read ``blocks`` before asking for the next part."""
+
+    filename: str
+    content_type: Optional[str]
+    blocks: AsyncIterator[bytes]
+
+
+def _form_boundary(request: Request) -> bytes:
+    media_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if media_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a multipart/form-data upload.",
+        )
+    return boundary
+
+
+async def iter_form_files(request: Request, field: str, max_bytes: Optional[int] = None) -> AsyncIterator[FormFile]:
+    """Stream the file parts named ``field`` of a multipart/form-data request, in order.
+
+    Nothing is buffered: each part's ``blocks`` come straight off the request
+    body, and a part the caller does not read is skipped. The body is held to
+    ``max_bytes`` (default MAX_UPLOAD_BYTES) plus FORM_OVERHEAD_BYTES: up
+    front from a declared Content-Length, and as part data arrives, so a
+    chunked body cannot get past it either. Per-file caps are the caller's
+    (e.g. ``spool_blocks``).
+    """
+    check_content_length(request, max_bytes)
+    limit = (config.MAX_UPLOAD_BYTES if max_bytes is None else max_bytes) + FORM_OVERHEAD_BYTES
+    received = 0
+    events = _form_events(request, _form_boundary(request))
+
+    def count(data: bytes) -> None:
+        nonlocal received
+        received += len(data)
+        if received > limit:
+            raise _too_large(max_bytes)
+
+    async def blocks() -> AsyncIterator[bytes]:
+        async for event, data in events:
+            if event == "data":
+                count(data)
+                yield data
+            elif event == "end":
+                return
+
+    try:
+        headers: Dict[bytes, bytes] = {}
+        name = value = b""
+        async for event, data in events:
+            if event == "begin":
+                headers = {}
+            elif event == "field":
+                count(data)
+                name += data
+            elif event == "value":
+                count(data)
+                value += data
+            elif event == "header":
+                headers[name.lower()] = value
+                name = value = b""
+            elif event == "data":
+                count(data)
+            elif event == "headers":
+                _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+                if disposition.get(b"name") != field.encode() or b"filename" not in disposition:
+                    continue
+                content_type = headers.get(b"content-type")
+                yield FormFile(
+                    filename=disposition[b"filename"].decode("utf-8", errors="replace"),
+                    content_type=content_type.decode("latin-1") if content_type else None,
+                    blocks=blocks(),
+                )
+    finally:
+        await events.aclose()
+
+
+async def spool_form_file(request: Request, field: str = "file", max_bytes: Optional[int] = None) -> Spooled:
+    """Stream one file field of a multipart/form-data request straight into a spool file.
+
+    ``UploadFile`` parameters are only handed over after Starlette has read
+    the whole body into its own temp file, so a size check there comes too
+    late. Here ``iter_form_files`` holds the body to the cap, and the running
+    cap in ``spool_blocks`` stops it as soon as the file part passes
+    ``max_bytes``. Fields after the file part are not read.
+    """
+    files = iter_form_files(request, field, max_bytes)
+    try:
+        async for part in files:
+            spooled = await spool_blocks(part.blocks, suffix=Path(part.filename).suffix, max_bytes=max_bytes)
+            spooled.content_type = part.content_type
+            spooled.filename = part.filename
+            return spooled
+    finally:
+        await files.aclose()
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Missing file field '{field}'.",
+    )
+
+
+def _last_modified(path: Path) -> float:
+    mtime = path.stat().st_mtime
+    if path.is_dir():
+        for entry in path.iterdir():
+            mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def clear_spool() -> None:
+    """Remove spool files left behind by dead processes (jobs do not survive restarts).
+
+    Called at startup by every worker. It clears this process's own directory
+    (a previous process with the same pid) and those of processes on this host
+    that are gone; directories of other hosts sharing the volume, and loose
+    files from the old flat layout, only once idle for STALE_SPOOL_SECONDS.
+    """
+    if not config.SPOOL_DIR.exists():
+        return
+    cutoff = time.time() - STALE_SPOOL_SECONDS
+    for entry in config.SPOOL_DIR.iterdir():
+        try:
+            gone = worker_gone(entry.name) if entry.is_dir() else None
+            stale = gone if gone is not None else _last_modified(entry) < cutoff
+            if not stale:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+        except FileNotFoundError:
+            continue  # removed by another worker starting at the same time
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+def l2_normalize(mat: np.ndarray) -> np.ndarray:
+    """Return ``mat`` scaled to unit L2 norm along the last axis.
+
+    Zero vectors are left as zeros so they score 0.0 against any query.
+    """
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    return np.divide(mat, norms, out=np.zeros_like(mat), where=norms != 0.0)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first.
+
+    Uses ``argpartition`` so selection is O(n) and only the winners are sorted.
+    """
+    n = int(scores.shape[0])
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
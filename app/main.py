@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
@@ -7,12 +9,30 @@ import json
 
 from app.lib.logger import request_logging_middleware
 from app.lib import db as db_module
+from app.lib.answer_cache import answer_cache
+from app.lib.embedding_cache import embedding_cache, query_embedding_cache
+from app.lib.http import close_http_client
+from app.lib.jobs import ingest_jobs
+from app.lib.pipeline import fail_interrupted_documents
+from app.lib.parsers import shutdown_parse_pool
+from app.lib.uploads import clear_spool
 from app.routes.chats import router as chats_router
 from app.routes.documents import router as documents_router
 from app.routes.messages import router as messages_router
 from app.routes.auth import router as auth_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clear_spool()
+    await fail_interrupted_documents()
+    ingest_jobs.start()
+    yield
+    await ingest_jobs.stop()
+    await close_http_client()
+    shutdown_parse_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Lightweight request logging
 app.middleware("http")(request_logging_middleware)
@@ -60,7 +80,15 @@ app.add_middleware(
 @app.get("/health")
 async def health():
     db_ok = await db_module.check_health() if db_module else False
-    return {"ok": True, "db": db_ok}
+    return {
+        "ok": True,
+        "db": db_ok,
+        "caches": {
+            "embeddings": embedding_cache.stats(),
+            "queryEmbeddings": query_embedding_cache.stats(),
+            "answers": answer_cache.stats(),
+        },
+    }
 
 # Include routes
 app.include_router(auth_router)
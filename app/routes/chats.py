@@ -6,6 +6,7 @@ from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
 
+from app.lib.answer_cache import answer_cache
 from app.lib.auth import get_current_user
 from app.lib.db import SessionLocal
 from app.store.models import Chat, Document, Message
@@ -86,17 +87,14 @@ async def delete_chat(chat_id: str, user_id: str = Depends(get_current_user)):
             raise HTTPException(status_code=404, detail="Chat not found")
         # Delete messages in chat
         await session.execute(delete(Message).where(Message.chat_id == chat_uuid))
-        # Find documents in chat
-        res = await session.execute(select(Document.id).where(Document.chat_id == chat_uuid))
-        doc_ids = [row[0] for row in res.all()]
-        # Delete chunks for documents
-        for did in doc_ids:
-            await session.execute(delete(Chunk).where(Chunk.document_id == did))
+        # Delete chunks in chat (single statement; one partition when partitioned)
+        await session.execute(delete(Chunk).where(Chunk.chat_id == chat_uuid))
         # Delete documents
         await session.execute(delete(Document).where(Document.chat_id == chat_uuid))
         # Delete chat
         await session.delete(chat)
         await session.commit()
+        answer_cache.invalidate(chat_id)
         return {"ok": True}
 
 
@@ -1,14 +1,38 @@
 from __future__ import annotations
 
+import asyncio
 import uuid
-from typing import List, Optional
+from pathlib import Path
+from typing import Dict, List, Optional
 
-import httpx
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 
 from app import config
+from app.lib.answer_cache import answer_cache
 from app.lib.auth import get_current_user
-from app.lib.pipeline import ingest_document
+from app.lib.jobs import IngestJob, JobRunner, ingest_jobs
+from app.lib.pipeline import (
+    create_pending_document,
+    discard_document,
+    duplicate_result,
+    find_duplicate,
+    get_owned_document,
+    ingest_document,
+    update_document,
+)
+from app.lib.bulk import (
+    BulkFile,
+    BulkLimits,
+    assign_documents,
+    create_pending,
+    discard_pending,
+    expand_archive,
+    is_archive,
+    run_bulk,
+)
+from app.lib.http import fetch_to_spool
+from app.lib.uploads import iter_form_files, spool_blocks, spool_form_file
 from app.lib.db import SessionLocal
 from app.store.models import Document
 from sqlalchemy import delete, select
@@ -16,6 +40,37 @@ from sqlalchemy import delete, select
 
 router = APIRouter()
 
+# Upload routes read the multipart body themselves (see spool_form_file and
+# upload_bulk); these keep the forms documented in OpenAPI.
+_FILE_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+_BULK_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["files"],
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                }
+            }
+        },
+    }
+}
+
 
 @router.get("/chats/{chat_id}/documents")
 async def list_documents(chat_id: str, user_id: str = Depends(get_current_user)):
@@ -32,6 +87,10 @@ async def list_documents(chat_id: str, user_id: str = Depends(get_current_user))
                 "sizeBytes": int(d.size_bytes),
                 "numChunks": int(d.num_chunks),
                 "indexed": bool(d.indexed),
+                # pending: queued or being ingested; failed: see error, a new version (PUT) retries
+                "status": "indexed" if d.indexed else ("failed" if d.ingest_error else "pending"),
+                "error": d.ingest_error,
+                "truncated": bool(d.truncated),
                 "createdAt": int(d.created_at),
                 "updatedAt": int(d.updated_at),
             }
@@ -39,54 +98,241 @@ async def list_documents(chat_id: str, user_id: str = Depends(get_current_user))
         ]
 
 
-@router.post("/chats/{chat_id}/documents/file")
+def _parse_chat_id(chat_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(chat_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid chatId")
+
+
+async def _enqueue(
+    job: IngestJob, runner: JobRunner, size_bytes: int, content_hash: Optional[str] = None
+) -> JSONResponse:
+    """Record the pending Document, queue the job and answer 202 with its id."""
+    await create_pending_document(
+        document_id=job.document_id,
+        chat_id=job.chat_id,
+        uploader_user_id=job.user_id,
+        filename=job.filename,
+        size_bytes=size_bytes,
+        content_hash=content_hash,
+    )
+
+    async def run(job: IngestJob) -> Dict[str, object]:
+        try:
+            return await runner(job)
+        except BaseException:
+            await discard_document(job.document_id, chat_id=job.chat_id)
+            raise
+
+    try:
+        ingest_jobs.submit(job, run)
+    except HTTPException:
+        await discard_document(job.document_id, chat_id=job.chat_id)
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"ok": True, "jobId": job.id, "documentId": job.document_id, "status": job.status},
+    )
+
+
+@router.post("/chats/{chat_id}/documents/file", openapi_extra=_FILE_FORM)
 async def upload_file(
     chat_id: str,
-    file: UploadFile = File(...),
+    request: Request,
     user_id: str = Depends(get_current_user),
 ):
-    data = await file.read()
-    size_bytes = len(data)
-    if size_bytes > config.MAX_UPLOAD_BYTES:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File too large. Max {config.MAX_UPLOAD_MB}MB.",
-        )
-    result = await ingest_document(
-        filename=file.filename,
-        data=data,
-        chat_id=chat_id,
-        uploader_user_id=user_id,
-        size_bytes=size_bytes,
+    _parse_chat_id(chat_id)
+    # Stream the file part into a spool file the job owns, enforcing MAX_UPLOAD_MB as it arrives.
+    spooled = await spool_form_file(request)
+    path = spooled.path
+    if not spooled.size_bytes:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file uploaded.")
+    # Same bytes already indexed in this chat: answer right away, no job.
+    duplicate = await find_duplicate(chat_id, spooled.content_hash)
+    if duplicate is not None:
+        path.unlink(missing_ok=True)
+        return duplicate_result(duplicate)
+    filename = spooled.filename or "upload"
+    job = ingest_jobs.new_job(user_id=user_id, chat_id=chat_id, filename=filename)
+
+    async def runner(job: IngestJob) -> Dict[str, object]:
+        try:
+            return await ingest_document(
+                filename=filename,
+                path=path,
+                chat_id=chat_id,
+                uploader_user_id=user_id,
+                document_id=job.document_id,
+                size_bytes=spooled.size_bytes,
+                content_hash=spooled.content_hash,
+                progress=job.progress,
+                pending=True,
+            )
+        finally:
+            path.unlink(missing_ok=True)
+
+    try:
+        return await _enqueue(job, runner, spooled.size_bytes, spooled.content_hash)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+
+@router.post("/chats/{chat_id}/documents/bulk", openapi_extra=_BULK_FORM)
+async def upload_bulk(
+    chat_id: str,
+    request: Request,
+    user_id: str = Depends(get_current_user),
+):
+    _parse_chat_id(chat_id)
+    limits = BulkLimits()
+    spooled: List[BulkFile] = []
+    # Parts are streamed one at a time, so the request total, each file's
+    # MAX_UPLOAD_MB and the expanded total are enforced as bytes arrive.
+    parts = iter_form_files(request, "files", config.BULK_MAX_TOTAL_BYTES)
+    try:
+        async for part in parts:
+            name = part.filename or "upload"
+            limits.add_part()
+            if is_archive(name):
+                archive = await spool_blocks(
+                    part.blocks, suffix=Path(name).suffix, max_bytes=config.BULK_MAX_TOTAL_BYTES
+                )
+                try:
+                    spooled.extend(await asyncio.to_thread(expand_archive, name, archive.path, limits))
+                finally:
+                    archive.path.unlink(missing_ok=True)
+                continue
+            limits.add_file()
+            item = await spool_blocks(limits.counted(part.blocks), suffix=Path(name).suffix)
+            spooled.append(BulkFile(name, item.path, item.size_bytes, item.content_hash))
+    except BaseException:
+        for item in spooled:
+            item.path.unlink(missing_ok=True)
+        raise
+    finally:
+        await parts.aclose()
+    if not spooled:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files to ingest.")
+
+    assign_documents(spooled)
+    job = ingest_jobs.new_job(user_id=user_id, chat_id=chat_id, filename=f"{len(spooled)} files")
+    job.document_id = None
+
+    async def runner(job: IngestJob) -> Dict[str, object]:
+        return await run_bulk(job, spooled, chat_id=chat_id, user_id=user_id)
+
+    try:
+        await create_pending(spooled, chat_id=chat_id, user_id=user_id)
+        try:
+            ingest_jobs.submit(job, runner)
+        except BaseException:
+            await discard_pending(spooled, chat_id=chat_id)
+            raise
+    except BaseException:
+        for item in spooled:
+            item.path.unlink(missing_ok=True)
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "ok": True,
+            "jobId": job.id,
+            "status": job.status,
+            "files": [{"filename": f.filename, "documentId": f.document_id} for f in spooled],
+        },
     )
-    return result
 
 
 @router.post("/chats/{chat_id}/documents/url")
 async def ingest_url(chat_id: str, payload: dict, user_id: str = Depends(get_current_user)):
+    _parse_chat_id(chat_id)
     file_url = payload.get("fileUrl")
     filename = payload.get("filename")
     if not file_url or not filename:
         raise HTTPException(status_code=400, detail="fileUrl and filename are required")
-    headers = {"User-Agent": "rag-fastapi/1.0"}
-    async with httpx.AsyncClient(timeout=30.0, headers=headers) as client:
+    job = ingest_jobs.new_job(user_id=user_id, chat_id=chat_id, filename=filename)
+
+    async def runner(job: IngestJob) -> Dict[str, object]:
+        job.progress("fetch")
+        spooled = await fetch_to_spool(file_url)
+        try:
+            return await ingest_document(
+                filename=filename,
+                path=spooled.path,
+                chat_id=chat_id,
+                uploader_user_id=user_id,
+                document_id=job.document_id,
+                size_bytes=spooled.size_bytes,
+                content_type=spooled.content_type,
+                content_hash=spooled.content_hash,
+                progress=job.progress,
+                pending=True,
+            )
+        finally:
+            spooled.path.unlink(missing_ok=True)
+
+    # Size is unknown until the fetch runs; the Document is updated on completion.
+    return await _enqueue(job, runner, 0)
+
+
+@router.put("/documents/{document_id}/file", openapi_extra=_FILE_FORM)
+async def update_file(
+    document_id: str,
+    request: Request,
+    user_id: str = Depends(get_current_user),
+):
+    doc = await get_owned_document(document_id, user_id)
+    if not doc.indexed and doc.ingest_error is None:
+        raise HTTPException(status_code=409, detail="Document is still being ingested.")
+    spooled = await spool_form_file(request)
+    path = spooled.path
+    if not spooled.size_bytes:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty file uploaded.")
+    filename = spooled.filename or doc.filename
+    job = ingest_jobs.new_job(user_id=user_id, chat_id=str(doc.chat_id), filename=filename)
+    job.document_id = document_id
+
+    async def runner(job: IngestJob) -> Dict[str, object]:
         try:
-            resp = await client.get(file_url, follow_redirects=True)
-        except httpx.HTTPError:
-            raise HTTPException(status_code=400, detail="Failed to fetch the file URL.")
-    if resp.status_code != 200:
-        raise HTTPException(status_code=400, detail="Failed to fetch the file URL.")
-    data = resp.content
-    if len(data) > config.MAX_UPLOAD_BYTES:
-        raise HTTPException(status_code=400, detail=f"File too large. Max {config.MAX_UPLOAD_MB}MB.")
-    result = await ingest_document(
-        filename=filename,
-        data=data,
-        chat_id=chat_id,
-        uploader_user_id=user_id,
-        size_bytes=len(data),
+            return await update_document(
+                document_id=document_id,
+                user_id=user_id,
+                filename=filename,
+                path=path,
+                size_bytes=spooled.size_bytes,
+                content_hash=spooled.content_hash,
+                progress=job.progress,
+            )
+        finally:
+            path.unlink(missing_ok=True)
+
+    # The old version stays searchable until the job swaps the chunks.
+    try:
+        ingest_jobs.submit(job, runner)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"ok": True, "jobId": job.id, "documentId": job.document_id, "status": job.status},
     )
-    return result
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_current_user)):
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid jobId")
+    job = ingest_jobs.get(job_id)
+    # Other users' jobs are reported as missing rather than forbidden.
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 
 @router.delete("/documents/{document_id}")
@@ -101,9 +347,10 @@ async def delete_document(document_id: str, user_id: str = Depends(get_current_u
         # Delete chunks
         from app.store.vector_store import VectorStore  # avoid cycle at import
 
-        removed = await VectorStore(config.VEC_PATH).delete_by_document_id(document_id)
+        removed = await VectorStore(config.VEC_PATH).delete_by_document_id(document_id, chat_id=str(doc.chat_id))
         await session.execute(delete(Document).where(Document.id == uuid.UUID(document_id)))
         await session.commit()
+        answer_cache.invalidate(str(doc.chat_id))
         return {"ok": True, "removed": int(removed)}
 
 
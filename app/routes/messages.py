@@ -1,21 +1,30 @@
 from __future__ import annotations
 
+import json
 import time
 import uuid
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Hashable, List, Optional
 
-import google.generativeai as genai
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 
 from app import config
+from app.lib.answer_cache import CachedAnswer, answer_cache
 from app.lib.auth import get_current_user
-from app.lib.embeddings import embed_query
+from app.lib.context import build_context
+from app.lib.embeddings import cached_query_embedding, embed_query_async
+from app.lib.generation import generate_answer_async, stream_answer_async
+from app.lib.logger import get_logger
+from app.lib.providers import get_provider
+from app.lib.rerank import mmr_rerank
 from app.lib.db import SessionLocal
 from app.store.models import Message
 from app.store.vector_store import VectorStore
 
 
 router = APIRouter()
+logger = get_logger("rag.ask")
 
 
 @router.get("/chats/{chat_id}/messages")
@@ -71,59 +80,133 @@ async def add_user_message(chat_id: str, payload: dict, user_id: str = Depends(g
         return {"id": str(msg.id), "role": msg.role, "content": msg.content, "createdAt": msg.created_at}
 
 
-@router.post("/chats/{chat_id}/ask")
-async def ask(chat_id: str, payload: dict, user_id: str = Depends(get_current_user)):
+@dataclass
+class _AskContext:
+    """Retrieval result shared by ``ask`` and ``ask_stream``."""
+
+    chat_id: str
+    query: str
+    query_vec: List[float]
+    params: Hashable  # retrieval settings; answers are only reused under the same ones
+    generation: int  # answer_cache generation read before retrieval
+    prompt: Optional[str] = None  # None when nothing relevant was found (or on a cache hit)
+    sources: List[dict] = field(default_factory=list)
+    cached: Optional[CachedAnswer] = None
+    query_embedding_cached: bool = False
+    started: float = field(default_factory=time.perf_counter)
+    # Milliseconds per stage: embedMs, searchMs, generateMs (stages that ran)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def timed(self, stage: str, since: float) -> None:
+        self.timings[stage] = round((time.perf_counter() - since) * 1000.0, 1)
+
+    def remember(self, answer: str) -> None:
+        """Store a freshly generated answer in the semantic cache."""
+        if self.prompt is None or self.cached is not None:
+            return
+        answer_cache.put(
+            self.chat_id,
+            self.generation,
+            query=self.query,
+            query_vec=self.query_vec,
+            params=self.params,
+            answer=answer,
+            sources=self.sources,
+        )
+
+    def meta(self) -> dict:
+        """``Message.meta`` for the assistant reply: latency breakdown and cache use."""
+        self.timed("totalMs", self.started)
+        meta: dict = {"timings": self.timings, "queryEmbeddingCached": self.query_embedding_cached}
+        if self.cached is not None:
+            meta["answerCache"] = {
+                "hit": True,
+                "similarity": round(self.cached.similarity, 4),
+                "matchedQuery": self.cached.query,
+            }
+        return meta
+
+
+NO_CONTEXT_ANSWER = "I couldn't find relevant context."
+
+
+async def _prepare_ask(chat_id: str, payload: dict, user_id: str) -> _AskContext:
+    """Validate the ask body, store the user message and retrieve context."""
     q: str = (payload.get("q") or "").strip()
     k: int = int(payload.get("k") or 15)
+    use_mmr = bool(payload["mmr"]) if payload.get("mmr") is not None else config.MMR_ENABLED
     if not q:
         raise HTTPException(status_code=400, detail="q is required")
+    try:
+        ef_search: Optional[int] = int(payload["efSearch"]) if payload.get("efSearch") is not None else None
+        probes: Optional[int] = int(payload["probes"]) if payload.get("probes") is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="efSearch and probes must be integers")
     try:
         chat_uuid = uuid.UUID(chat_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid chatId")
 
     # Write user message
-    user_msg = await add_user_message(chat_id, {"content": q}, user_id)  # type: ignore[arg-type]
+    await add_user_message(chat_id, {"content": q}, user_id)  # type: ignore[arg-type]
+
+    # Read before retrieval so an answer built on since-changed documents is not cached.
+    generation = answer_cache.generation(chat_id)
+    started = time.perf_counter()
+    q_vec = cached_query_embedding(q)
+    embedding_cached = q_vec is not None
+    if q_vec is None:
+        q_vec = await embed_query_async(q)
+    ctx = _AskContext(
+        chat_id=chat_id,
+        query=q,
+        query_vec=q_vec,
+        params=(k, ef_search, probes, use_mmr, get_provider().embedding_model),
+        generation=generation,
+        query_embedding_cached=embedding_cached,
+        started=started,
+    )
+    if not embedding_cached:
+        ctx.timed("embedMs", started)
+    ctx.cached = answer_cache.get(chat_id, q_vec, ctx.params)
+    if ctx.cached is not None:
+        ctx.sources = ctx.cached.sources
+        return ctx
 
     vec_store = VectorStore(config.VEC_PATH)
-    q_vec = embed_query(q)
-    results = await vec_store.search(q_vec, chat_id=str(chat_uuid), k=k)
-
-    context_items = results[:8]
-    context_texts: List[str] = []
-    for row, score in context_items:
-        text: str = str(row.get("text", ""))
-        context_texts.append(text)
-
-    if not context_texts:
-        answer = "I couldn't find relevant context."
-        sources: List[dict] = []
-    else:
-        genai.configure(api_key=config.GOOGLE_API_KEY)
-        if not config.GOOGLE_API_KEY:
-            raise HTTPException(status_code=400, detail="Missing GOOGLE_API_KEY. Please set it in the environment.")
-        prompt = (
-            "You are a helpful assistant. Answer the question using ONLY the provided context. "
-            "If unknown, say you don't know.\n\n"
-            f"Question: {q}\n\n"
-            "Context:\n" + "\n---\n".join(context_texts)
+    searched = time.perf_counter()
+    if use_mmr:
+        # Over-fetch, then keep the k most relevant-yet-diverse candidates.
+        candidates = await vec_store.search(
+            q_vec,
+            chat_id=str(chat_uuid),
+            k=k * config.MMR_FETCH_FACTOR,
+            ef_search=ef_search,
+            probes=probes,
+            with_embeddings=True,
         )
-        try:
-            model = genai.GenerativeModel(config.GENERATION_MODEL)
-            resp = model.generate_content(prompt)
-            answer = resp.text.strip() if getattr(resp, "text", None) else ""
-            if not answer:
-                raise HTTPException(status_code=502, detail="Model returned empty response.")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=502, detail="Failed to generate an answer.")
-        sources = [
-            {"filename": str(r[0].get("filename")), "chunkId": int(r[0].get("chunkId", 0))}
-            for r in context_items
-        ]
+        results = mmr_rerank(q_vec, candidates, k=k)
+    else:
+        results = await vec_store.search(q_vec, chat_id=str(chat_uuid), k=k, ef_search=ef_search, probes=probes)
+    ctx.timed("searchMs", searched)
 
-    # Persist assistant message
+    # Adjacent chunks are merged without their repeated overlap, up to CONTEXT_TOKEN_BUDGET.
+    blocks = build_context(results)
+    if not blocks:
+        return ctx
+    ctx.prompt = (
+        "You are a helpful assistant. Answer the question using ONLY the provided context. "
+        "If unknown, say you don't know.\n\n"
+        f"Question: {q}\n\n"
+        "Context:\n" + "\n---\n".join(b.text for b in blocks)
+    )
+    ctx.sources = [
+        {"filename": str(b.filename), "chunkId": chunk_id} for b in blocks for chunk_id in b.chunk_ids
+    ]
+    return ctx
+
+
+async def _save_assistant_message(chat_id: str, answer: str, meta: Optional[dict] = None) -> Message:
     if not SessionLocal:
         raise HTTPException(status_code=500, detail="Database not configured")
     now = int(time.time())
@@ -135,12 +218,75 @@ async def ask(chat_id: str, payload: dict, user_id: str = Depends(get_current_us
             content=answer,
             tokens_in=None,
             tokens_out=None,
-            meta=None,
+            meta=meta,
             created_at=now,
         )
         session.add(msg)
         await session.commit()
+        return msg
 
-    return {"answer": answer, "sources": sources}
 
+@router.post("/chats/{chat_id}/ask")
+async def ask(chat_id: str, payload: dict, user_id: str = Depends(get_current_user)):
+    ctx = await _prepare_ask(chat_id, payload, user_id)
+    if ctx.cached is not None:
+        answer = ctx.cached.answer
+    elif ctx.prompt is None:
+        answer = NO_CONTEXT_ANSWER
+    else:
+        generating = time.perf_counter()
+        answer = await generate_answer_async(ctx.prompt)
+        ctx.timed("generateMs", generating)
+        ctx.remember(answer)
+
+    # Persist assistant message
+    await _save_assistant_message(chat_id, answer, ctx.meta())
+
+    return {"answer": answer, "sources": ctx.sources}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chats/{chat_id}/ask/stream")
+async def ask_stream(chat_id: str, payload: dict, user_id: str = Depends(get_current_user)):
+    """``ask`` as server-sent events: sources, then answer tokens, then done.
+
+    Validation and retrieval happen before the response starts, so their
+    errors keep their HTTP status; later failures arrive as an ``error`` event.
+    The assistant message is stored only when the answer is complete.
+    """
+    ctx = await _prepare_ask(chat_id, payload, user_id)
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("sources", {"sources": ctx.sources})
+        parts: List[str] = []
+        try:
+            if ctx.cached is not None or ctx.prompt is None:
+                whole = ctx.cached.answer if ctx.cached is not None else NO_CONTEXT_ANSWER
+                parts.append(whole)
+                yield _sse("token", {"text": whole})
+            else:
+                generating = time.perf_counter()
+                async for piece in stream_answer_async(ctx.prompt):
+                    parts.append(piece)
+                    yield _sse("token", {"text": piece})
+                ctx.timed("generateMs", generating)
+                ctx.remember("".join(parts).strip())
+            msg = await _save_assistant_message(chat_id, "".join(parts).strip(), ctx.meta())
+        except HTTPException as exc:
+            yield _sse("error", {"detail": str(exc.detail)})
+            return
+        except Exception:
+            logger.exception("streamed answer for chat %s failed", chat_id)
+            yield _sse("error", {"detail": "Failed to generate an answer."})
+            return
+        yield _sse("done", {"id": str(msg.id), "role": msg.role, "createdAt": int(msg.created_at)})
 
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Proxies must pass events through as they are written.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+
+Row = Dict[str, object]
+
+# Rough per-row overhead of the metadata dict on top of its text.
+_ROW_OVERHEAD_BYTES = 256
+
+
+class ChatIndex:
+    """In-memory search index for one chat: a contiguous matrix plus row metadata."""
+
+    def __init__(self, embeddings: np.ndarray, rows: List[Row]) -> None:
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.rows = rows
+        self.nbytes = int(self.embeddings.nbytes) + sum(
+            len(str(r.get("text", ""))) + _ROW_OVERHEAD_BYTES for r in rows
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def appended(self, embeddings: np.ndarray, rows: List[Row]) -> "ChatIndex":
+        return ChatIndex(np.concatenate([self.embeddings, embeddings]), self.rows + rows)
+
+    def without(self, drop: np.ndarray) -> "ChatIndex":
+        keep = np.flatnonzero(~drop)
+        return ChatIndex(self.embeddings[keep], [self.rows[i] for i in keep])
+
+
+class ChatIndexCache:
+    """LRU cache of per-chat indexes bounded by a memory budget in bytes.
+
+    Entries are tagged with the store version they were built from; when the
+    store reports a different version (e.g. another worker wrote), everything
+    is dropped. Writes made through this process patch entries in place.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: "OrderedDict[str, ChatIndex]" = OrderedDict()
+        self._bytes = 0
+        self._version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, chat_id: str, version: Hashable) -> Optional[ChatIndex]:
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+                return None
+            index = self._entries.get(chat_id)
+            if index is not None:
+                self._entries.move_to_end(chat_id)
+            return index
+
+    def put(self, chat_id: str, index: ChatIndex, version: Hashable) -> None:
+        if not self.enabled or index.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            self._set(chat_id, index)
+            self._evict()
+
+    def append(self, chat_id: str, embeddings: np.ndarray, rows: List[Row]) -> None:
+        """Add freshly written rows to a cached chat, if it is cached."""
+        with self._lock:
+            index = self._entries.get(chat_id)
+            if index is not None:
+                self._set(chat_id, index.appended(embeddings, rows))
+                self._evict()
+
+    def drop_rows(self, key: str, values: Iterable[str]) -> None:
+        """Remove rows whose ``key`` field is in ``values`` from every cached chat."""
+        targets = set(values)
+        with self._lock:
+            for chat_id, index in list(self._entries.items()):
+                drop = np.fromiter((str(r.get(key)) in targets for r in index.rows), dtype=bool, count=len(index))
+                if drop.any():
+                    self._set(chat_id, index.without(drop))
+
+    def advance(self, previous: Hashable, version: Hashable) -> None:
+        """Record a write made by this process so patched entries stay valid."""
+        with self._lock:
+            if self._version != previous:
+                self._clear()
+            self._version = version
+
+    def _set(self, chat_id: str, index: ChatIndex) -> None:
+        old = self._entries.pop(chat_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._entries[chat_id] = index
+        self._bytes += index.nbytes
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            _, index = self._entries.popitem(last=False)
+            self._bytes -= index.nbytes
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
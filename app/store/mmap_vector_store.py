@@ -0,0 +1,607 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app import config
+from app.lib.logger import get_logger
+from app.lib.vectors import l2_normalize, top_k
+from app.store.index_cache import ChatIndex, ChatIndexCache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms only get the in-process lock
+    fcntl = None  # type: ignore[assignment]
+
+
+Row = Dict[str, object]
+
+MANIFEST_FILE = "MANIFEST"
+TOMBSTONES_FILE = "tombstones.bin"
+LOCK_FILE = "LOCK"
+LEGACY_CURRENT_FILE = "CURRENT"
+EMBEDDINGS_FILE = "embeddings.f32"
+META_FILE = "meta.bin"
+TEXT_FILE = "text.bin"
+
+# One fixed-width record per chunk; ids are stored as raw 16-byte UUIDs so
+# filtering by chat or document is a vectorized byte comparison.
+META_DTYPE = np.dtype(
+    [
+        ("id", "V16"),
+        ("chat", "V16"),
+        ("doc", "V16"),
+        ("chunk", "<i4"),
+        ("created", "<i8"),
+        ("text_off", "<i8"),
+        ("text_len", "<i4"),
+    ]
+)
+
+# A tombstone hides every row of ``doc`` written in a segment with a lower seq.
+TOMBSTONE_DTYPE = np.dtype([("seq", "<i8"), ("doc", "V16")])
+
+_MERGE_BLOCK_ROWS = 65536
+# Most segments one compaction merges, so a single pass never rewrites the whole store
+_MERGE_FANOUT = 8
+
+logger = get_logger("rag.vectors")
+
+
+def _uuid_key(value: object) -> np.void:
+    return np.void(uuid.UUID(str(value)).bytes)
+
+
+def _uuid_str(key: np.void) -> str:
+    return str(uuid.UUID(bytes=bytes(key)))
+
+
+def _key64(keys: np.ndarray) -> np.ndarray:
+    """First 8 bytes of each 16-byte key as uint64: a fast pre-filter before exact byte checks."""
+    return np.ascontiguousarray(keys).view("<u8")[::2]
+
+
+class _Segment:
+    """Immutable on-disk segment: embedding matrix, metadata sidecar and text blob."""
+
+    def __init__(self, path: Path, dim: int, seq: int) -> None:
+        self.path = path
+        self.dim = dim
+        self.seq = seq
+        meta_size = (path / META_FILE).stat().st_size
+        n = meta_size // META_DTYPE.itemsize
+        if n:
+            self.meta = np.memmap(path / META_FILE, dtype=META_DTYPE, mode="r", shape=(n,))
+            self.embeddings = np.memmap(path / EMBEDDINGS_FILE, dtype=np.float32, mode="r", shape=(n, dim))
+        else:
+            self.meta = np.zeros(0, dtype=META_DTYPE)
+            self.embeddings = np.zeros((0, dim), dtype=np.float32)
+        if (path / TEXT_FILE).stat().st_size:
+            self.text_blob = np.memmap(path / TEXT_FILE, dtype=np.uint8, mode="r")
+        else:
+            self.text_blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return int(self.meta.shape[0])
+
+    def text_bytes(self, i: int) -> bytes:
+        off = int(self.meta["text_off"][i])
+        length = int(self.meta["text_len"][i])
+        return bytes(self.text_blob[off : off + length])
+
+    def row(self, i: int) -> Row:
+        rec = self.meta[i]
+        return {
+            "id": _uuid_str(rec["id"]),
+            "documentId": _uuid_str(rec["doc"]),
+            "chunkId": int(rec["chunk"]),
+            "chatId": _uuid_str(rec["chat"]),
+            "text": self.text_bytes(i).decode("utf-8"),
+            "createdAt": int(rec["created"]),
+        }
+
+
+class MmapVectorStore:
+    """File-backed local vector store built from append-only memory-mapped segments.
+
+    Every ``upsert`` writes one new immutable segment (float32 embedding matrix,
+    metadata sidecar, text blob) and every ``delete_by_document_id`` appends a
+    record to the tombstone log, so a write costs the size of the change, not
+    the corpus. ``MANIFEST`` lists the live segments with their sequence
+    numbers; a row is visible unless a later segment rewrote its id or a
+    tombstone with a higher seq names its document. When segments or dead rows
+    pile up, a background compaction merges a bounded run of adjacent segments.
+
+    Embeddings are L2-normalized on write, so cosine similarity is a single
+    matrix-vector product against the normalized query. Per-chat indexes are
+    kept in an in-process LRU cache; writes through this instance patch cached
+    chats, and a manifest change made by another process drops the cache.
+    Writers in different processes are serialized with a lock file.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        legacy_path: Optional[Path] = None,
+        dim: int = config.EMBEDDING_DIM,
+        cache_bytes: int = config.VECTOR_CACHE_MB * 1024 * 1024,
+        compact_segments: int = config.VECTOR_COMPACT_SEGMENTS,
+    ) -> None:
+        self.directory = directory
+        self.dim = dim
+        self.compact_segments = compact_segments
+        self._lock = threading.RLock()
+        self._cache = ChatIndexCache(cache_bytes)
+        self._segments: List[_Segment] = []
+        self._live: List[np.ndarray] = []
+        self._dead = 0
+        self._tombstones: Dict[bytes, int] = {}
+        self._tombstone_offset = 0
+        self._tombstone_epoch = 0
+        self._state_version: Optional[Tuple[int, int]] = None
+        self._compacting = False
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not (self.directory / MANIFEST_FILE).exists():
+            self._bootstrap(legacy_path)
+        with self._lock:
+            self._refresh()
+        self._maybe_compact()
+
+    # ------------------------------------------------------------------ files
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        with self._lock:
+            with open(self.directory / LOCK_FILE, "a+b") as fh:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Dict[str, object]:
+        return json.loads((self.directory / MANIFEST_FILE).read_text(encoding="utf-8"))
+
+    def _write_manifest(self, manifest: Dict[str, object]) -> None:
+        tmp = self.directory / f"{MANIFEST_FILE}.tmp"
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp, self.directory / MANIFEST_FILE)
+
+    def _tombstones_path(self, epoch: int) -> Path:
+        # Each compaction starts a new log file, so a reader's offset never points into a rewritten one.
+        return self.directory / (TOMBSTONES_FILE if epoch == 0 else f"tombstones.{epoch}.bin")
+
+    def _version(self) -> Tuple[int, int]:
+        st = os.stat(self.directory / MANIFEST_FILE)
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _segment_dir(self, seq: int) -> Path:
+        path = self.directory / f"seg-{seq:012d}"
+        # A directory with this seq can only be debris from a crashed writer:
+        # the seq is not in the manifest yet and we hold the write lock.
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        return path
+
+    def _bootstrap(self, legacy_path: Optional[Path]) -> None:
+        with self._write_lock():
+            if (self.directory / MANIFEST_FILE).exists():
+                return
+            segments: List[Dict[str, object]] = []
+            current = self.directory / LEGACY_CURRENT_FILE
+            if current.exists():
+                # Single-snapshot layout: adopt its segment as seq 0.
+                name = current.read_text(encoding="utf-8").strip()
+                segments.append({"name": name, "seq": 0})
+            elif legacy_path is not None and legacy_path.exists():
+                # One-time import of an existing vec.json so switching backends keeps data.
+                text = legacy_path.read_text(encoding="utf-8")
+                try:
+                    data = json.loads(text) if text.strip() else []
+                except json.JSONDecodeError:
+                    data = []
+                rows = [r for r in data if isinstance(r, dict) and "id" in r] if isinstance(data, list) else []
+                if rows:
+                    path = self._write_segment(rows, 0)
+                    segments.append({"name": path.name, "seq": 0})
+            self._write_manifest({"nextSeq": 1, "segments": segments})
+            current.unlink(missing_ok=True)
+
+    def _write_segment(self, rows: List[Row], seq: int) -> Path:
+        n = len(rows)
+        meta = np.zeros(n, dtype=META_DTYPE)
+        embeddings = np.zeros((n, self.dim), dtype=np.float32)
+        parts: List[bytes] = []
+        offset = 0
+        for j, r in enumerate(rows):
+            emb = r.get("embedding")
+            if isinstance(emb, list) and emb:
+                if len(emb) != self.dim:
+                    raise ValueError(f"Embedding has {len(emb)} dimensions, expected {self.dim}.")
+                embeddings[j] = np.asarray(emb, dtype=np.float32)
+            encoded = str(r.get("text", "")).encode("utf-8")
+            meta["id"][j] = _uuid_key(r["id"])
+            meta["chat"][j] = _uuid_key(r["chatId"])
+            meta["doc"][j] = _uuid_key(r["documentId"])
+            meta["chunk"][j] = int(r.get("chunkId", 0))  # type: ignore[arg-type]
+            meta["created"][j] = int(r.get("createdAt", 0))  # type: ignore[arg-type]
+            meta["text_off"][j] = offset
+            meta["text_len"][j] = len(encoded)
+            parts.append(encoded)
+            offset += len(encoded)
+        path = self._segment_dir(seq)
+        l2_normalize(embeddings).tofile(path / EMBEDDINGS_FILE)
+        (path / TEXT_FILE).write_bytes(b"".join(parts))
+        meta.tofile(path / META_FILE)
+        return path
+
+    def _merge_segments(self, path: Path, segments: List[_Segment], lives: List[np.ndarray]) -> int:
+        """Write the live rows of ``segments`` into the new segment at ``path``; returns the row count."""
+        path.mkdir(parents=True)
+        offset = 0
+        rows = 0
+        with open(path / EMBEDDINGS_FILE, "wb") as emb_fh, open(path / TEXT_FILE, "wb") as text_fh, open(
+            path / META_FILE, "wb"
+        ) as meta_fh:
+            for seg, live in zip(segments, lives):
+                live_idx = np.flatnonzero(live)
+                for start in range(0, live_idx.size, _MERGE_BLOCK_ROWS):
+                    idx = live_idx[start : start + _MERGE_BLOCK_ROWS]
+                    meta = np.array(seg.meta[idx])
+                    for j, i in enumerate(idx):
+                        data = seg.text_bytes(int(i))
+                        meta["text_off"][j] = offset
+                        text_fh.write(data)
+                        offset += len(data)
+                    np.asarray(seg.embeddings[idx]).tofile(emb_fh)
+                    meta.tofile(meta_fh)
+                    rows += idx.size
+        return rows
+
+    # ------------------------------------------------------------------ state
+
+    def _refresh(self) -> None:
+        """Replay the manifest and tombstone log into in-memory state (caller holds ``_lock``)."""
+        for attempt in range(3):
+            version = self._version()
+            if version == self._state_version:
+                return
+            try:
+                manifest = self._read_manifest()
+                loaded = {seg.path.name: seg for seg in self._segments}
+                segments: List[_Segment] = []
+                for entry in manifest["segments"]:  # type: ignore[union-attr]
+                    name = str(entry["name"])
+                    seg = loaded.get(name) or _Segment(self.directory / name, self.dim, int(entry["seq"]))
+                    segments.append(seg)
+                epoch = int(manifest.get("tombstoneEpoch", 0))  # type: ignore[arg-type]
+                if epoch != self._tombstone_epoch:
+                    # A compaction (maybe in another process) started a new log; replay it from the start.
+                    self._tombstones = {}
+                    self._tombstone_offset = 0
+                    self._tombstone_epoch = epoch
+                self._read_tombstones()
+            except FileNotFoundError:
+                # A compaction swapped the manifest and removed segments or the old log under us; re-read.
+                if attempt == 2:
+                    raise
+                continue
+            self._segments = segments
+            self._recompute_live()
+            self._state_version = version
+            return
+
+    def _read_tombstones(self) -> None:
+        """Apply records appended to the current log since the last read."""
+        path = self._tombstones_path(self._tombstone_epoch)
+        if self._tombstone_epoch == 0 and not path.exists():
+            return
+        # A missing later-epoch log means a newer compaction removed it; the caller re-reads.
+        size = path.stat().st_size
+        count = (size - self._tombstone_offset) // TOMBSTONE_DTYPE.itemsize
+        if count <= 0:
+            return
+        with open(path, "rb") as fh:
+            fh.seek(self._tombstone_offset)
+            records = np.frombuffer(fh.read(count * TOMBSTONE_DTYPE.itemsize), dtype=TOMBSTONE_DTYPE)
+        for rec in records:
+            key = bytes(rec["doc"])
+            self._tombstones[key] = max(self._tombstones.get(key, -1), int(rec["seq"]))
+        self._tombstone_offset += count * TOMBSTONE_DTYPE.itemsize
+
+    def _recompute_live(self) -> None:
+        segments = self._segments
+        if not segments:
+            self._live = []
+            self._dead = 0
+            return
+        ids = np.concatenate([seg.meta["id"] for seg in segments])
+        live = np.ones(ids.shape[0], dtype=bool)
+
+        # An id written again in a later segment hides its earlier copies.
+        keys = _key64(ids)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        collide = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+        if collide.size:
+            positions = np.unique(np.concatenate([order[collide], order[collide + 1]]))
+            latest: Dict[bytes, int] = {}
+            for pos in positions:
+                latest[bytes(ids[pos])] = int(pos)
+            winners = set(latest.values())
+            for pos in positions:
+                if int(pos) not in winners:
+                    live[pos] = False
+
+        if self._tombstones:
+            docs = np.concatenate([seg.meta["doc"] for seg in segments])
+            seqs = np.concatenate([np.full(len(seg), seg.seq, dtype=np.int64) for seg in segments])
+            tomb_keys = np.fromiter(
+                (int.from_bytes(k[:8], "little") for k in self._tombstones),
+                dtype=np.uint64,
+                count=len(self._tombstones),
+            )
+            for pos in np.flatnonzero(np.isin(_key64(docs), tomb_keys)):
+                seq = self._tombstones.get(bytes(docs[pos]))
+                if seq is not None and seq > seqs[pos]:
+                    live[pos] = False
+
+        self._dead = int(live.size - live.sum())
+        self._live = np.split(live, np.cumsum([len(seg) for seg in segments])[:-1])
+
+    # ------------------------------------------------------------------ compaction
+
+    def _needs_compaction(self) -> bool:
+        total = sum(len(seg) for seg in self._segments)
+        return len(self._segments) > self.compact_segments or (self._dead > 0 and self._dead * 4 > total)
+
+    def _pick_run(self) -> Optional[Tuple[int, int]]:
+        """Adjacent segments ``[start, stop)`` for one bounded merge, or None when none is due.
+
+        With too many segments, pick the window of at most _MERGE_FANOUT that
+        removes the most segments per live row copied, so runs of small recent
+        segments merge first and large old ones are rarely rewritten. With too
+        many dead rows, rewrite the segment holding the most of them.
+        """
+        segments = self._segments
+        if len(segments) > self.compact_segments and len(segments) > 1:
+            live = [int(np.count_nonzero(m)) for m in self._live]
+            best: Optional[Tuple[int, int]] = None
+            best_cost = 0.0
+            for start in range(len(segments) - 1):
+                rows = live[start]
+                for stop in range(start + 2, min(len(segments), start + _MERGE_FANOUT) + 1):
+                    rows += live[stop - 1]
+                    cost = (rows + 1) / (stop - start - 1)
+                    if best is None or cost < best_cost:
+                        best, best_cost = (start, stop), cost
+            return best
+        total = sum(len(seg) for seg in segments)
+        if self._dead > 0 and self._dead * 4 > total:
+            dead = [len(seg) - int(np.count_nonzero(m)) for seg, m in zip(segments, self._live)]
+            i = int(np.argmax(dead))
+            return i, i + 1
+        return None
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            if self._compacting or not self._needs_compaction():
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="vector-compaction", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            while self.compact():
+                pass
+        except Exception:
+            logger.exception("Vector store compaction failed")
+        finally:
+            self._compacting = False
+
+    def _spent_tombstones(self, records: np.ndarray, segments: List[_Segment]) -> np.ndarray:
+        """Mask of tombstone ``records`` that no longer name a row in an older segment."""
+        needed = np.zeros(records.shape[0], dtype=bool)
+        if not records.size:
+            return needed
+        docs = _key64(records["doc"])
+        for seg in segments:
+            if len(seg):
+                needed |= (records["seq"] > seg.seq) & np.isin(docs, _key64(seg.meta["doc"]))
+        return ~needed
+
+    def compact(self) -> bool:
+        """Merge one bounded run of adjacent segments, dropping deleted and superseded rows.
+
+        The write lock is only held to choose the run and to swap it for the
+        merged segment in MANIFEST; rows are copied without it, so uploads,
+        deletes and searches carry on meanwhile. The merged segment takes the
+        highest seq of its run: tombstones and segments written during the
+        copy are newer and still apply on top of it. Returns False when no
+        merge was due or the run changed under us.
+        """
+        with self._write_lock():
+            self._refresh()
+            run = self._pick_run()
+            if run is None:
+                return False
+            start, stop = run
+            segments = list(self._segments)
+            chosen = segments[start:stop]
+            lives = self._live[start:stop]
+            epoch = self._tombstone_epoch
+            log = self._tombstones_path(epoch)
+            spent_upto = log.stat().st_size if log.exists() else 0
+        seq = max(seg.seq for seg in chosen)
+        merged = self.directory / f"seg-{seq:012d}-{uuid.uuid4().hex[:8]}"
+        try:
+            rows = self._merge_segments(merged, chosen, lives)
+            merged_seg = _Segment(merged, self.dim, seq) if rows else None
+            if not rows:
+                # Every row of the run is dead: the run is just dropped from MANIFEST.
+                shutil.rmtree(merged, ignore_errors=True)
+            others = segments[:start] + ([merged_seg] if merged_seg else []) + segments[stop:]
+            # Tombstones already logged at the snapshot that hide nothing once the run is merged.
+            records = np.zeros(0, dtype=TOMBSTONE_DTYPE)
+            if spent_upto:
+                try:
+                    records = np.fromfile(log, dtype=TOMBSTONE_DTYPE, count=spent_upto // TOMBSTONE_DTYPE.itemsize)
+                except FileNotFoundError:
+                    pass  # another process already started a new log; leave pruning to it
+            spent = self._spent_tombstones(records, others)
+        except BaseException:
+            shutil.rmtree(merged, ignore_errors=True)
+            raise
+
+        with self._write_lock():
+            self._refresh()
+            names = [seg.path.name for seg in self._segments]
+            chosen_names = [seg.path.name for seg in chosen]
+            at = names.index(chosen_names[0]) if chosen_names[0] in names else -1
+            if at < 0 or names[at : at + len(chosen_names)] != chosen_names:
+                # Another process compacted these segments first.
+                shutil.rmtree(merged, ignore_errors=True)
+                return False
+            previous = self._state_version
+            manifest = self._read_manifest()
+            entries = list(manifest["segments"])  # type: ignore[call-overload]
+            replacement = [{"name": merged.name, "seq": seq}] if rows else []
+            manifest["segments"] = entries[:at] + replacement + entries[at + len(chosen_names) :]
+            old_log: Optional[Path] = None
+            if spent.any() and self._tombstone_epoch == epoch:
+                # Start a new log with the live tombstones plus any appended since the snapshot.
+                tail = log.read_bytes()[spent_upto:]
+                new_epoch = epoch + 1
+                with open(self._tombstones_path(new_epoch), "wb") as fh:
+                    fh.write(records[~spent].tobytes())
+                    fh.write(tail)
+                manifest["tombstoneEpoch"] = new_epoch
+                old_log = log
+            self._write_manifest(manifest)
+            self._refresh()
+            # Visible rows are unchanged, so cached chats stay valid.
+            self._cache.advance(previous, self._state_version)
+        if old_log is not None and old_log.name != TOMBSTONES_FILE:
+            # tombstones.bin is kept: a missing epoch-0 log reads as "no deletes yet".
+            old_log.unlink(missing_ok=True)
+        for seg in chosen:
+            shutil.rmtree(seg.path, ignore_errors=True)
+        logger.info("Compacted %d vector segments into %s", len(chosen), merged.name if rows else "nothing")
+        return True
+
+    # ------------------------------------------------------------------ API
+
+    def upsert(self, rows: Iterable[Row]) -> int:
+        new_rows = list(rows)
+        if not new_rows:
+            return 0
+        # Later rows win for duplicate ids, matching the JSON store.
+        by_id: Dict[str, Row] = {str(r.get("id")): r for r in new_rows}
+        with self._write_lock():
+            self._refresh()
+            previous = self._state_version
+            dead_before = self._dead
+            manifest = self._read_manifest()
+            seq = int(manifest["nextSeq"])  # type: ignore[arg-type]
+            path = self._write_segment(list(by_id.values()), seq)
+            manifest["segments"].append({"name": path.name, "seq": seq})  # type: ignore[union-attr]
+            manifest["nextSeq"] = seq + 1
+            self._write_manifest(manifest)
+            self._refresh()
+            self._cache.advance(previous, self._state_version)
+            if self._dead > dead_before:
+                self._cache.drop_rows("id", by_id.keys())
+            segment = self._segments[-1]
+            chats = segment.meta["chat"]
+            for chat_key in np.unique(chats):
+                idx = np.flatnonzero(chats == chat_key)
+                self._cache.append(
+                    _uuid_str(chat_key),
+                    np.asarray(segment.embeddings[idx]),
+                    [segment.row(int(i)) for i in idx],
+                )
+        self._maybe_compact()
+        return len(new_rows)
+
+    def delete_by_document_id(self, document_id: str) -> int:
+        key = _uuid_key(document_id)
+        with self._write_lock():
+            self._refresh()
+            removed = sum(
+                int(np.count_nonzero((seg.meta["doc"] == key) & live))
+                for seg, live in zip(self._segments, self._live)
+            )
+            if not removed:
+                return 0
+            previous = self._state_version
+            manifest = self._read_manifest()
+            seq = int(manifest["nextSeq"])  # type: ignore[arg-type]
+            record = np.array([(seq, key)], dtype=TOMBSTONE_DTYPE)
+            with open(self._tombstones_path(self._tombstone_epoch), "ab") as fh:
+                fh.write(record.tobytes())
+            manifest["nextSeq"] = seq + 1
+            self._write_manifest(manifest)
+            self._refresh()
+            self._cache.advance(previous, self._state_version)
+            self._cache.drop_rows("documentId", [document_id])
+        self._maybe_compact()
+        return removed
+
+    def document_chunks(self, document_id: str) -> List[Row]:
+        """Live rows of one document with their (normalized) embeddings, in chunk order."""
+        key = _uuid_key(document_id)
+        rows: List[Row] = []
+        with self._lock:
+            self._refresh()
+            for seg, live in zip(self._segments, self._live):
+                for i in np.flatnonzero((seg.meta["doc"] == key) & live):
+                    row = seg.row(int(i))
+                    row["embedding"] = np.asarray(seg.embeddings[int(i)]).tolist()
+                    rows.append(row)
+        rows.sort(key=lambda r: int(r["chunkId"]))  # type: ignore[arg-type]
+        return rows
+
+    def _chat_index(self, chat_id: str) -> ChatIndex:
+        key = _uuid_key(chat_id)
+        blocks: List[np.ndarray] = []
+        rows: List[Row] = []
+        for seg, live in zip(self._segments, self._live):
+            idx = np.flatnonzero((seg.meta["chat"] == key) & live)
+            if idx.size:
+                blocks.append(np.asarray(seg.embeddings[idx]))
+                rows.extend(seg.row(int(i)) for i in idx)
+        embeddings = np.concatenate(blocks) if blocks else np.zeros((0, self.dim), dtype=np.float32)
+        return ChatIndex(embeddings, rows)
+
+    def search(
+        self, query_vec: List[float], *, chat_id: str, k: int = 15, with_embeddings: bool = False
+    ) -> List[Tuple[Row, float]]:
+        if k <= 0:
+            return []
+        index = self._cache.get(chat_id, self._version())
+        if index is None:
+            with self._lock:
+                self._refresh()
+                index = self._chat_index(chat_id)
+                self._cache.put(chat_id, index, self._state_version)
+        if not len(index):
+            return []
+        q = l2_normalize(np.asarray(query_vec, dtype=np.float32))
+        scores = index.embeddings @ q
+        winners = top_k(scores, k)
+        hits = [(dict(index.rows[i]), float(scores[i])) for i in winners]
+        if with_embeddings:
+            for (row, _), i in zip(hits, winners):
+                row["embedding"] = index.embeddings[i]
+        return hits
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import BigInteger, Boolean, Index, Integer, String, JSON
+from sqlalchemy import BigInteger, Boolean, Index, Integer, PrimaryKeyConstraint, String, JSON, false
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, declarative_base
 import uuid
@@ -46,11 +46,20 @@ class Document(Base):
     storage_key: Mapped[str | None] = mapped_column(String, nullable=True)
     num_chunks: Mapped[int] = mapped_column(Integer, nullable=False)
     indexed: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    # Set when a parse budget stopped extraction early and only a prefix is indexed
+    truncated: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default=false())
+    # SHA-256 of the uploaded bytes; a chat never indexes the same content twice
+    content_hash: Mapped[str | None] = mapped_column(String, nullable=True)
+    # Worker (host-pid) running a pending document's ingestion, to spot ones a restart orphaned
+    ingest_owner: Mapped[str | None] = mapped_column(String, nullable=True)
+    # Why ingestion failed; such a document stays unindexed until a new version is uploaded
+    ingest_error: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
     updated_at: Mapped[int] = mapped_column(BigInteger, nullable=False)
 
 
 Index("idx_documents_chat_id", Document.chat_id)
+Index("idx_documents_chat_content_hash", Document.chat_id, Document.content_hash)
 
 
 class Message(Base):
@@ -71,8 +80,15 @@ Index("idx_messages_chat_time", Message.chat_id, Message.created_at)
 
 class Chunk(Base):
     __tablename__ = "chunks"
-
-    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # chat_id leads the primary key: it serves per-chat filters and deletes, and
+    # is required in the key when the table is hash-partitioned by chat.
+    __table_args__ = (
+        PrimaryKeyConstraint("chat_id", "id", name="chunks_pkey"),
+        {"postgresql_partition_by": "HASH (chat_id)"} if config.CHUNKS_HASH_PARTITIONS > 0 else {},
+    )
+
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), default=uuid.uuid4)
+    chat_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
     document_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
     chunk_id: Mapped[int] = mapped_column(Integer, nullable=False)
     text: Mapped[str] = mapped_column(String, nullable=False)
@@ -81,6 +97,17 @@ class Chunk(Base):
 
 
 Index("idx_chunks_document_id", Chunk.document_id)
+Index(
+    "idx_chunks_embedding_ann",
+    Chunk.embedding,
+    postgresql_using=config.VECTOR_INDEX_TYPE,
+    postgresql_with=(
+        {"lists": config.IVFFLAT_LISTS}
+        if config.VECTOR_INDEX_TYPE == "ivfflat"
+        else {"m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+    ),
+    postgresql_ops={"embedding": "vector_cosine_ops"},
+)
 
 
 class Account(Base):
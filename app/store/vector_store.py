@@ -1,29 +1,54 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import threading
+import uuid
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import numpy as np
-from sqlalchemy import delete, select
+from sqlalchemy import delete, select, text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from app import config
 from app.lib.db import SessionLocal
+from app.lib.vectors import l2_normalize, top_k
+from app.store.mmap_vector_store import MmapVectorStore
 from app.store.models import Document, Chunk
 
 
 Row = Dict[str, object]
 
+_CHUNK_COLUMNS = ("id", "chat_id", "document_id", "chunk_id", "text", "embedding", "created_at")
+_STAGING_DDL = (
+    "CREATE TEMP TABLE chunks_staging (id uuid, chat_id uuid, document_id uuid, chunk_id integer, "
+    "text text, embedding real[], created_at bigint) ON COMMIT DROP"
+)
+_MERGE_STAGING = (
+    "INSERT INTO chunks (id, chat_id, document_id, chunk_id, text, embedding, created_at) "
+    "SELECT id, chat_id, document_id, chunk_id, text, embedding::vector, created_at FROM chunks_staging "
+    "ON CONFLICT (chat_id, id) DO UPDATE SET document_id = EXCLUDED.document_id, "
+    "chunk_id = EXCLUDED.chunk_id, text = EXCLUDED.text, embedding = EXCLUDED.embedding, "
+    "created_at = EXCLUDED.created_at"
+)
+
+
+def _as_uuid(value: object) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
 
 class JsonVectorStore:
     def __init__(self, path: Path) -> None:
         self.path = path
+        # Calls arrive from worker threads; a read must not see a half-written file.
+        self._lock = threading.RLock()
         if not self.path.exists():
             self.path.write_text("[]", encoding="utf-8")
 
     def _read(self) -> List[Row]:
-        text = self.path.read_text(encoding="utf-8")
+        with self._lock:
+            text = self.path.read_text(encoding="utf-8")
         try:
             data = json.loads(text) if text.strip() else []
         except json.JSONDecodeError:
@@ -33,71 +58,104 @@ class JsonVectorStore:
         return data  # type: ignore[return-value]
 
     def _write(self, rows: List[Row]) -> None:
-        self.path.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        with self._lock:
+            self.path.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
 
     def upsert(self, rows: Iterable[Row]) -> int:
-        existing = self._read()
-        by_id: Dict[str, Row] = {str(r["id"]): r for r in existing if "id" in r}
-        count = 0
-        for row in rows:
-            row_id = str(row.get("id"))
-            by_id[row_id] = row
-            count += 1
-        merged = list(by_id.values())
-        merged.sort(key=lambda r: (int(r.get("createdAt", 0)), str(r.get("id", ""))))
-        self._write(merged)
-        return count
+        with self._lock:
+            existing = self._read()
+            by_id: Dict[str, Row] = {str(r["id"]): r for r in existing if "id" in r}
+            count = 0
+            for row in rows:
+                row_id = str(row.get("id"))
+                by_id[row_id] = row
+                count += 1
+            merged = list(by_id.values())
+            merged.sort(key=lambda r: (int(r.get("createdAt", 0)), str(r.get("id", ""))))
+            self._write(merged)
+            return count
 
     def delete_by_document_id(self, document_id: str) -> int:
-        rows = self._read()
-        kept: List[Row] = []
-        removed = 0
-        for r in rows:
-            if str(r.get("documentId")) == document_id:
-                removed += 1
-            else:
-                kept.append(r)
-        self._write(kept)
-        return removed
-
-    @staticmethod
-    def _cosine(a: np.ndarray, b: np.ndarray) -> float:
-        if a.size == 0 or b.size == 0:
-            return 0.0
-        denom = (np.linalg.norm(a) * np.linalg.norm(b))
-        if denom == 0.0:
-            return 0.0
-        return float(np.dot(a, b) / denom)
-
-    def search(self, query_vec: List[float], *, chat_id: str, k: int = 15) -> List[Tuple[Row, float]]:
-        rows = self._read()
-        q = np.array(query_vec, dtype=np.float32)
-        candidates: List[Tuple[Row, float]] = []
-        for r in rows:
-            if str(r.get("chatId")) != chat_id:
-                continue
-            emb = r.get("embedding")
-            if not isinstance(emb, list):
-                continue
-            v = np.array(emb, dtype=np.float32)
-            score = self._cosine(q, v)
-            candidates.append((r, score))
-        candidates.sort(key=lambda rs: (-rs[1], str(rs[0].get("id", ""))))
-        return candidates[: max(0, k)]
+        with self._lock:
+            rows = self._read()
+            kept: List[Row] = []
+            removed = 0
+            for r in rows:
+                if str(r.get("documentId")) == document_id:
+                    removed += 1
+                else:
+                    kept.append(r)
+            self._write(kept)
+            return removed
+
+    def document_chunks(self, document_id: str) -> List[Row]:
+        rows = [dict(r) for r in self._read() if str(r.get("documentId")) == document_id]
+        rows.sort(key=lambda r: int(r.get("chunkId", 0)))  # type: ignore[arg-type]
+        return rows
+
+    def search(
+        self, query_vec: List[float], *, chat_id: str, k: int = 15, with_embeddings: bool = False
+    ) -> List[Tuple[Row, float]]:
+        # Rows carry their embedding already, so ``with_embeddings`` needs no extra work.
+        rows = [
+            r
+            for r in self._read()
+            if str(r.get("chatId")) == chat_id and isinstance(r.get("embedding"), list)
+        ]
+        if not rows or k <= 0:
+            return []
+        q = l2_normalize(np.asarray(query_vec, dtype=np.float32))
+        mat = np.zeros((len(rows), q.shape[0]), dtype=np.float32)
+        for i, r in enumerate(rows):
+            emb = r["embedding"]
+            if len(emb) == q.shape[0]:  # type: ignore[arg-type]
+                mat[i] = emb
+        scores = l2_normalize(mat) @ q
+        return [(rows[i], float(scores[i])) for i in top_k(scores, k)]
+
+
+LocalStore = Union[JsonVectorStore, MmapVectorStore]
+_local_stores: Dict[Tuple[str, Path], LocalStore] = {}
+
+
+def _local_store(path: Path) -> LocalStore:
+    """Return the process-wide local store for ``path`` (one instance per backend)."""
+    backend = config.LOCAL_VECTOR_STORE
+    key = (backend, path)
+    store = _local_stores.get(key)
+    if store is None:
+        if backend == "json":
+            store = JsonVectorStore(path)
+        else:
+            store = MmapVectorStore(config.VEC_DIR, legacy_path=path)
+        _local_stores[key] = store
+    return store
 
 
 class VectorStore:
-    """Pgvector-backed vector store with JSON fallback by feature flag."""
+    """Pgvector-backed vector store with a local (mmap or JSON) fallback by feature flag.
+
+    Local store calls do blocking file I/O (and can wait on another writer's
+    lock), so they run in a worker thread instead of on the event loop.
+    """
 
     def __init__(self, path: Path) -> None:
-        self._json = JsonVectorStore(path)
+        self._local = _local_store(path)
+
+    async def upsert(self, rows: Iterable[Row], *, mode: Optional[str] = None) -> int:
+        """Insert or replace chunks, in batches of VECTOR_UPSERT_BATCH_SIZE.
 
-    async def upsert(self, rows: Iterable[Row]) -> int:
+        ``mode`` (default VECTOR_UPSERT_MODE) picks the pgvector write path:
+        "copy" streams rows with binary COPY into a staging table and merges
+        them with one INSERT ... SELECT; "insert" uses multi-row INSERT
+        statements. Both are one transaction.
+        """
         if config.USE_JSON_VECTOR_STORE or not SessionLocal:
-            return self._json.upsert(rows)
+            return await asyncio.to_thread(self._local.upsert, list(rows))
         values = [
             {
                 "id": r["id"],
+                "chat_id": r["chatId"],
                 "document_id": r["documentId"],
                 "chunk_id": r["chunkId"],
                 "text": r["text"],
@@ -108,52 +166,191 @@ class VectorStore:
         ]
         if not values:
             return 0
+        if (mode or config.VECTOR_UPSERT_MODE) == "copy":
+            return await self._upsert_copy(values)
+        return await self._upsert_insert(values)
+
+    async def _upsert_insert(self, values: List[Row]) -> int:
+        # Postgres allows at most 32767 bind parameters per statement.
+        batch = max(1, min(config.VECTOR_UPSERT_BATCH_SIZE, 32767 // len(_CHUNK_COLUMNS)))
         async with SessionLocal() as session:  # type: ignore[arg-type]
-            stmt = pg_insert(Chunk).values(values)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=[Chunk.id],
-                set_={
-                    "document_id": stmt.excluded.document_id,
-                    "chunk_id": stmt.excluded.chunk_id,
-                    "text": stmt.excluded.text,
-                    "embedding": stmt.excluded.embedding,
-                    "created_at": stmt.excluded.created_at,
-                },
-            )
-            await session.execute(stmt)
+            for start in range(0, len(values), batch):
+                stmt = pg_insert(Chunk).values(values[start : start + batch])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Chunk.chat_id, Chunk.id],
+                    set_={
+                        "document_id": stmt.excluded.document_id,
+                        "chunk_id": stmt.excluded.chunk_id,
+                        "text": stmt.excluded.text,
+                        "embedding": stmt.excluded.embedding,
+                        "created_at": stmt.excluded.created_at,
+                    },
+                )
+                await session.execute(stmt)
+            await session.commit()
+            return len(values)
+
+    async def _upsert_copy(self, values: List[Row]) -> int:
+        batch = max(1, config.VECTOR_UPSERT_BATCH_SIZE)
+        async with SessionLocal() as session:  # type: ignore[arg-type]
+            # ON COMMIT DROP keeps this safe behind transaction-mode poolers.
+            await session.execute(text(_STAGING_DDL))
+            conn = await session.connection()
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection  # asyncpg.Connection, inside the session's transaction
+            for start in range(0, len(values), batch):
+                records = [
+                    (
+                        _as_uuid(v["id"]),
+                        _as_uuid(v["chat_id"]),
+                        _as_uuid(v["document_id"]),
+                        int(v["chunk_id"]),  # type: ignore[arg-type]
+                        v["text"],
+                        # float4[] has a binary COPY codec in asyncpg; cast to vector on merge
+                        [float(x) for x in v["embedding"]],  # type: ignore[union-attr]
+                        int(v["created_at"]),  # type: ignore[arg-type]
+                    )
+                    for v in values[start : start + batch]
+                ]
+                await driver.copy_records_to_table("chunks_staging", records=records, columns=list(_CHUNK_COLUMNS))
+                await session.execute(text(_MERGE_STAGING))
+                await session.execute(text("TRUNCATE chunks_staging"))
             await session.commit()
             return len(values)
 
-    async def delete_by_document_id(self, document_id: str) -> int:
+    async def delete_by_document_id(self, document_id: str, *, chat_id: str) -> int:
+        """Delete a document's chunks; ``chat_id`` limits pgvector to the chat's partition."""
         if config.USE_JSON_VECTOR_STORE or not SessionLocal:
-            return self._json.delete_by_document_id(document_id)
+            return await asyncio.to_thread(self._local.delete_by_document_id, document_id)
         async with SessionLocal() as session:  # type: ignore[arg-type]
-            result = await session.execute(delete(Chunk).where(Chunk.document_id == document_id))
+            result = await session.execute(
+                delete(Chunk).where(Chunk.chat_id == _as_uuid(chat_id), Chunk.document_id == _as_uuid(document_id))
+            )
             await session.commit()
             return int(result.rowcount or 0)
 
-    async def search(self, query_vec: List[float], *, chat_id: str, k: int = 15) -> List[Tuple[Row, float]]:
+    async def document_chunks(self, document_id: str, *, chat_id: str) -> List[Row]:
+        """Stored chunks of one document (in chat ``chat_id``), with embeddings, in chunk order."""
         if config.USE_JSON_VECTOR_STORE or not SessionLocal:
-            return self._json.search(query_vec, chat_id=chat_id, k=k)
+            return await asyncio.to_thread(self._local.document_chunks, document_id)
         async with SessionLocal() as session:  # type: ignore[arg-type]
             stmt = (
-                select(Chunk, Document, Chunk.embedding.cosine_distance(query_vec).label("distance"))
-                .where(Chunk.document_id == Document.id)
-                .where(Document.chat_id == chat_id)
+                select(Chunk.id, Chunk.chat_id, Chunk.chunk_id, Chunk.text, Chunk.embedding, Chunk.created_at)
+                .where(Chunk.chat_id == _as_uuid(chat_id), Chunk.document_id == _as_uuid(document_id))
+                .order_by(Chunk.chunk_id)
+            )
+            res = await session.execute(stmt)
+            return [
+                {
+                    "id": str(c.id),
+                    "documentId": document_id,
+                    "chunkId": int(c.chunk_id),
+                    "chatId": str(c.chat_id),
+                    "text": c.text,
+                    "embedding": np.asarray(c.embedding, dtype=np.float32).tolist(),
+                    "createdAt": int(c.created_at),
+                }
+                for c in res.all()
+            ]
+
+    async def replace_document(
+        self, document_id: str, rows: List[Row], *, chat_id: str, unchanged_ids: Set[str], stale_ids: List[str]
+    ) -> None:
+        """Make ``rows`` the document's full set of chunks.
+
+        On pgvector only rows outside ``unchanged_ids`` are written and only
+        ``stale_ids`` are deleted. The local stores delete per document, so
+        there the document is dropped and ``rows`` written again.
+        """
+        if config.USE_JSON_VECTOR_STORE or not SessionLocal:
+            await asyncio.to_thread(self._local.delete_by_document_id, document_id)
+            await asyncio.to_thread(self._local.upsert, rows)
+            return
+        await self.upsert([r for r in rows if str(r["id"]) not in unchanged_ids])
+        size = max(1, config.VECTOR_UPSERT_BATCH_SIZE)
+        for start in range(0, len(stale_ids), size):
+            batch = [_as_uuid(i) for i in stale_ids[start : start + size]]
+            async with SessionLocal() as session:  # type: ignore[arg-type]
+                await session.execute(
+                    delete(Chunk).where(
+                        Chunk.chat_id == _as_uuid(chat_id),
+                        Chunk.document_id == _as_uuid(document_id),
+                        Chunk.id.in_(batch),
+                    )
+                )
+                await session.commit()
+
+    async def search(
+        self,
+        query_vec: List[float],
+        *,
+        chat_id: str,
+        k: int = 15,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        with_embeddings: bool = False,
+    ) -> List[Tuple[Row, float]]:
+        """Top-k chunks of a chat by cosine similarity.
+
+        ``ef_search``/``probes`` tune the pgvector ANN index for this query only
+        (defaults: HNSW_EF_SEARCH / IVFFLAT_PROBES); the local stores are exact.
+        ``with_embeddings`` adds each row's vector under "embedding" (for reranking).
+        """
+        if config.USE_JSON_VECTOR_STORE or not SessionLocal:
+            return await asyncio.to_thread(
+                self._local.search, query_vec, chat_id=chat_id, k=k, with_embeddings=with_embeddings
+            )
+        async with SessionLocal() as session:  # type: ignore[arg-type]
+            # SET LOCAL only lasts for this transaction; values are ints, never user text.
+            if config.VECTOR_INDEX_TYPE == "ivfflat":
+                n_probes = max(1, int(probes or config.IVFFLAT_PROBES))
+                await session.execute(text(f"SET LOCAL ivfflat.probes = {n_probes}"))
+            else:
+                # HNSW returns at most ef_search rows, so never search narrower than k.
+                ef = min(1000, max(k, int(ef_search or config.HNSW_EF_SEARCH)))
+                await session.execute(text(f"SET LOCAL hnsw.ef_search = {ef}"))
+            if config.VECTOR_ITERATIVE_SCAN in ("strict_order", "relaxed_order"):
+                await session.execute(
+                    text(f"SET LOCAL {config.VECTOR_INDEX_TYPE}.iterative_scan = {config.VECTOR_ITERATIVE_SCAN}")
+                )
+            # Rank on chunks alone (chat_id prunes to one partition when partitioned),
+            # then look up filenames for the k winners only.
+            columns = [
+                Chunk.id,
+                Chunk.chat_id,
+                Chunk.document_id,
+                Chunk.chunk_id,
+                Chunk.text,
+                Chunk.embedding.cosine_distance(query_vec).label("distance"),
+            ]
+            if with_embeddings:
+                columns.append(Chunk.embedding)
+            nearest = (
+                select(*columns)
+                .where(Chunk.chat_id == chat_id)
                 .order_by("distance")
                 .limit(max(0, k))
+                .subquery()
+            )
+            stmt = (
+                select(nearest, Document.filename)
+                .outerjoin(Document, Document.id == nearest.c.document_id)
+                .order_by(nearest.c.distance)
             )
             res = await session.execute(stmt)
             pairs: List[Tuple[Row, float]] = []
-            for chunk, doc, distance in res.all():
+            for chunk in res.all():
+                distance = chunk.distance
                 out: Row = {
                     "id": chunk.id,
-                    "documentId": str(doc.id),
-                    "filename": doc.filename,
+                    "documentId": str(chunk.document_id),
+                    "filename": chunk.filename,
                     "chunkId": chunk.chunk_id,
-                    "chatId": str(doc.chat_id),
+                    "chatId": str(chunk.chat_id),
                     "text": chunk.text,
                 }
+                if with_embeddings:
+                    out["embedding"] = np.asarray(chunk.embedding, dtype=np.float32)
                 sim = 1.0 - float(distance)
                 pairs.append((out, sim))
             return pairs
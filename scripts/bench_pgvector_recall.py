@@ -0,0 +1,131 @@
+"""Latency/recall benchmark for the pgvector ANN index against exact search.
+
+Loads a synthetic clustered corpus into a TEMP table on the configured
+database (DATABASE_URL), builds the same index the migration creates
+(VECTOR_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, IVFFLAT_LISTS) and, for each
+ef_search (HNSW) or probes (IVFFlat) value, reports p50/p95 latency and mean
+recall@k versus an exact sequential scan. Nothing outside the TEMP table is
+touched.
+
+Usage:
+    python scripts/bench_pgvector_recall.py --rows 100000 --queries 200 --knobs 10,20,40,80,160
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List, Sequence, Set
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app import config  # noqa: E402
+from app.lib import db  # noqa: E402
+from app.lib.vectors import l2_normalize  # noqa: E402
+
+
+def _literal(vec: Sequence[float]) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+
+
+def synthetic_corpus(rows: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # Clustered data behaves more like real embeddings than uniform noise.
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size=rows)
+    return l2_normalize(centers[labels] + 0.35 * rng.standard_normal((rows, dim), dtype=np.float32))
+
+
+async def top_ids(conn: AsyncConnection, q: str, k: int) -> List[int]:
+    res = await conn.execute(
+        text("SELECT id FROM bench_chunks ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"),
+        {"q": q, "k": k},
+    )
+    return [int(r[0]) for r in res.all()]
+
+
+async def run(args: argparse.Namespace) -> None:
+    if db.engine is None:
+        raise SystemExit("DATABASE_URL is not set.")
+    rng = np.random.default_rng(0)
+    corpus = synthetic_corpus(args.rows, args.dim, args.clusters, rng)
+    queries = [_literal(v) for v in synthetic_corpus(args.queries, args.dim, args.clusters, rng)]
+
+    async with db.engine.connect() as conn:
+        await conn.execute(
+            text(f"CREATE TEMP TABLE bench_chunks (id bigint PRIMARY KEY, embedding vector({args.dim}) NOT NULL)")
+        )
+        for start in range(0, args.rows, 1000):
+            batch = [
+                {"id": i, "emb": _literal(corpus[i])}
+                for i in range(start, min(args.rows, start + 1000))
+            ]
+            await conn.execute(text("INSERT INTO bench_chunks VALUES (:id, CAST(:emb AS vector))"), batch)
+        await conn.commit()
+
+        # Exact ground truth first, before any index exists.
+        truth: List[Set[int]] = []
+        exact_ms: List[float] = []
+        for q in queries:
+            start = time.perf_counter()
+            truth.append(set(await top_ids(conn, q, args.k)))
+            exact_ms.append((time.perf_counter() - start) * 1000.0)
+        await conn.commit()
+
+        if config.VECTOR_INDEX_TYPE == "ivfflat":
+            index_sql = f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {config.IVFFLAT_LISTS})"
+            knob = "ivfflat.probes"
+        else:
+            index_sql = (
+                "USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {config.HNSW_M}, ef_construction = {config.HNSW_EF_CONSTRUCTION})"
+            )
+            knob = "hnsw.ef_search"
+        start = time.perf_counter()
+        await conn.execute(text(f"CREATE INDEX ON bench_chunks {index_sql}"))
+        await conn.execute(text("ANALYZE bench_chunks"))
+        await conn.commit()
+        build_s = time.perf_counter() - start
+
+        print(f"rows={args.rows} dim={args.dim} k={args.k} index={config.VECTOR_INDEX_TYPE} build={build_s:.1f}s")
+        print(f"{'setting':>22} {'p50 ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+        print(f"{'exact':>22} {statistics.median(exact_ms):>8.2f} {_p95(exact_ms):>8.2f} {1.0:>9.3f}")
+        for value in (int(v) for v in args.knobs.split(",") if v.strip()):
+            latencies: List[float] = []
+            recalls: List[float] = []
+            for q, expected in zip(queries, truth):
+                await conn.execute(text(f"SET LOCAL {knob} = {value}"))
+                start = time.perf_counter()
+                got = await top_ids(conn, q, args.k)
+                latencies.append((time.perf_counter() - start) * 1000.0)
+                recalls.append(len(expected.intersection(got)) / max(1, len(expected)))
+                await conn.commit()
+            label = f"{knob}={value}"
+            print(f"{label:>22} {statistics.median(latencies):>8.2f} {_p95(latencies):>8.2f} {statistics.mean(recalls):>9.3f}")
+    await db.engine.dispose()
+
+
+def _p95(values: List[float]) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=config.EMBEDDING_DIM)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--knobs", default="10,20,40,80,160", help="ef_search (hnsw) or probes (ivfflat) values")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
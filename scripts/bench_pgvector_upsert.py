@@ -0,0 +1,89 @@
+"""Chunk write benchmark: multi-row INSERT vs binary COPY + merge into pgvector.
+
+Writes synthetic chunks for a throwaway chat id into the real `chunks` table
+of the configured database (DATABASE_URL) through VectorStore.upsert, once
+per mode, and deletes them again afterwards. Reports wall time and rows/s for
+each row count; VECTOR_UPSERT_BATCH_SIZE applies to both modes.
+
+Usage:
+    python scripts/bench_pgvector_upsert.py --rows 1000,50000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import delete
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app import config  # noqa: E402
+from app.lib import db  # noqa: E402
+from app.lib.vectors import l2_normalize  # noqa: E402
+from app.store.models import Chunk  # noqa: E402
+from app.store.vector_store import VectorStore  # noqa: E402
+
+
+def synthetic_rows(n: int, dim: int, chat_id: str, rng: np.random.Generator) -> List[Dict[str, object]]:
+    document_id = str(uuid.uuid4())
+    vecs = l2_normalize(rng.standard_normal((n, dim), dtype=np.float32)).tolist()
+    now = int(time.time())
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "documentId": document_id,
+            "chunkId": i,
+            "text": f"synthetic chunk {i} " * 40,
+            "embedding": vecs[i],
+            "createdAt": now,
+            "chatId": chat_id,
+        }
+        for i in range(n)
+    ]
+
+
+async def clear(chat_id: str) -> None:
+    async with db.SessionLocal() as session:  # type: ignore[misc]
+        await session.execute(delete(Chunk).where(Chunk.chat_id == chat_id))
+        await session.commit()
+
+
+async def run(args: argparse.Namespace) -> None:
+    if db.SessionLocal is None:
+        raise SystemExit("DATABASE_URL is not set.")
+    if config.USE_JSON_VECTOR_STORE:
+        raise SystemExit("Unset USE_JSON_VECTOR_STORE to benchmark pgvector.")
+    rng = np.random.default_rng(0)
+    store = VectorStore(config.VEC_PATH)
+    print(f"dim={args.dim} batch={config.VECTOR_UPSERT_BATCH_SIZE}")
+    print(f"{'rows':>8} {'mode':>7} {'seconds':>9} {'rows/s':>10}")
+    for n in (int(v) for v in args.rows.split(",") if v.strip()):
+        chat_id = str(uuid.uuid4())
+        rows = synthetic_rows(n, args.dim, chat_id, rng)
+        try:
+            for mode in ("insert", "copy"):
+                start = time.perf_counter()
+                await store.upsert(rows, mode=mode)
+                elapsed = time.perf_counter() - start
+                print(f"{n:>8} {mode:>7} {elapsed:>9.2f} {n / elapsed:>10.0f}")
+                await clear(chat_id)
+        finally:
+            await clear(chat_id)
+    await db.engine.dispose()  # type: ignore[union-attr]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,50000")
+    parser.add_argument("--dim", type=int, default=config.EMBEDDING_DIM)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Micro-benchmark: per-row cosine loop vs vectorized top-k search.
+
+Compares the original ``JsonVectorStore.search`` scoring (one ``np.array`` and
+two norms per row, then a full sort) with the normalized matrix-vector product
+plus ``argpartition`` used by the local stores. JSON decoding is excluded so
+only the scoring path is measured.
+
+Usage:
+    python scripts/bench_vector_search.py --sizes 10000,100000,1000000
+
+The legacy loop is measured up to ``--legacy-max`` rows (default 1M, about 35 s
+at that size). Above that its time is extrapolated linearly from the largest
+measured size and marked with ``~`` and "extrapolated".
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from app.lib.vectors import l2_normalize, top_k  # noqa: E402
+
+
+def legacy_search(rows: List[dict], q_list: List[float], k: int) -> List[tuple]:
+    q = np.array(q_list, dtype=np.float32)
+    candidates = []
+    for r in rows:
+        v = np.array(r["embedding"], dtype=np.float32)
+        denom = np.linalg.norm(q) * np.linalg.norm(v)
+        score = float(np.dot(q, v) / denom) if denom else 0.0
+        candidates.append((r, score))
+    candidates.sort(key=lambda rs: (-rs[1], str(rs[0].get("id", ""))))
+    return candidates[:k]
+
+
+def vectorized_search(mat: np.ndarray, q_list: List[float], k: int) -> np.ndarray:
+    q = l2_normalize(np.asarray(q_list, dtype=np.float32))
+    return top_k(mat @ q, k)
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-max", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    q_list = rng.standard_normal(args.dim).astype(np.float32).tolist()
+    # Legacy rows reference a small pool of Python lists: per-row cost is the
+    # same as with distinct lists, without gigabytes of float objects.
+    pool = [rng.standard_normal(args.dim).astype(np.float32).tolist() for _ in range(1024)]
+
+    print(f"{'chunks':>10} {'legacy ms':>12} {'vectorized ms':>14} {'speedup':>9}")
+    # (rows, ms) of the largest legacy run, the basis for extrapolation
+    measured = None
+    for n in (int(s) for s in args.sizes.split(",") if s.strip()):
+        mat = np.empty((n, args.dim), dtype=np.float32)
+        for start in range(0, n, 65536):
+            stop = min(n, start + 65536)
+            mat[start:stop] = l2_normalize(rng.standard_normal((stop - start, args.dim), dtype=np.float32))
+        fast = best_of(lambda: vectorized_search(mat, q_list, args.k), args.repeat)
+        if n <= args.legacy_max:
+            rows = [{"id": str(i), "embedding": pool[i % len(pool)]} for i in range(n)]
+            slow = best_of(lambda: legacy_search(rows, q_list, args.k), 1)
+            measured = (n, slow)
+            print(f"{n:>10} {slow:>12.1f} {fast:>14.2f} {slow / fast:>8.0f}x")
+            del rows
+        elif measured is not None:
+            # The legacy loop does the same work per row, so its time grows linearly.
+            slow = measured[1] * n / measured[0]
+            print(f"{n:>10} {'~' + format(slow, '.1f'):>12} {fast:>14.2f} {slow / fast:>8.0f}x  extrapolated from {measured[0]}")
+        else:
+            print(f"{n:>10} {'skipped':>12} {fast:>14.2f} {'-':>9}")
+        del mat
+
+
+if __name__ == "__main__":
+    main()